@@ -1,27 +1,34 @@
-import base64
-from flask import Flask, request, jsonify, send_file
-from markitdown import MarkItDown
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
+from datetime import timedelta
 import os
 from dotenv import load_dotenv
 import logging
-from celery import Celery
-from openai import OpenAI
+from celery import Celery, group, states
+from celery.exceptions import Ignore
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
 from celery.result import AsyncResult
 import httpx
 import time
-import pytesseract
-from pdf2image import convert_from_path
-import tempfile
-import cv2
-import numpy as np
-import hashlib
 import json
+import re
 from pathlib import Path
-from paddleocr import PaddleOCR
-import io
-from PIL import Image
+import shutil
+import uuid
+import zipfile
+from converter import (
+    ConversionCancelled,
+    ConversionControl,
+    allowed_file,
+    calculate_file_hash,
+    convert_document,
+    format_page,
+    parse_page_range,
+    read_cache_file,
+    write_cache_file,
+)
+from spreadsheet import SPREADSHEET_EXTENSIONS, convert_spreadsheet
+import storage
 
 # 确保在最开始就加载环境变量
 load_dotenv()
@@ -100,89 +107,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client for LLM functionality
-
-logger.info(f"Initializing OpenAI client with base_url: {base_url}")
-client = OpenAI(
-    base_url=base_url,
-    api_key=os.getenv('OPENAI_API_KEY'),
-
-    timeout=httpx.Timeout(60.0),  # 置较长的超时时间
-    max_retries=3,  # 添加重试次数
-)
-
-# Initialize MarkItDown with the OpenAI client
-md = MarkItDown(
-    llm_client=client,
-    llm_model=os.getenv('OPENAI_LLM_MODEL', 'text-davinci-003'),
-)
-
 # 配置文件夹
 UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
 MARKDOWN_FOLDER = os.path.join(os.getcwd(), 'markdown_files')
 DEBUG_FOLDER = os.path.join(os.getcwd(), 'debug')  # 添加调试目录
 CACHE_FOLDER = os.path.join(os.getcwd(), 'cache')
+BATCH_FOLDER = os.path.join(os.getcwd(), 'batches')  # 批量任务清单
+STORAGE_METRICS_PATH = os.path.join(os.getcwd(), 'storage_metrics.json')  # 存储清理统计
+# 取消标记保存在 Redis 中，由 worker 在页与页、引擎调用之间检查
+CANCEL_KEY_PREFIX = 'doctomd:cancel:'
+CANCEL_FLAG_TTL = 24 * 3600
+# 预览最多返回的字节数，避免把超大表格整个读入内存
+PREVIEW_MAX_BYTES = int(os.getenv('PREVIEW_MAX_BYTES', str(5 * 1024 * 1024)))
+# 文件内容的 SHA256
+FILE_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
 os.makedirs(CACHE_FOLDER, exist_ok=True)
 
 # 创建必要的目录
-for folder in [UPLOAD_FOLDER, MARKDOWN_FOLDER, DEBUG_FOLDER]:
+for folder in [UPLOAD_FOLDER, MARKDOWN_FOLDER, DEBUG_FOLDER, BATCH_FOLDER]:
     os.makedirs(folder, exist_ok=True)
 
-# Supported file extensions (根据 MarkItDown 文档)
-SUPPORTED_EXTENSIONS = (
-    # Documents
-    '.pdf', '.pptx', '.docx', '.xlsx',
-    # Images
-    '.jpg', '.jpeg', '.png',
-    # Audio
-    '.mp3', '.wav',
-    # Text-based formats
-    '.html', '.csv', '.json', '.xml',
-    # Archives
-    '.zip'
-)
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in [ext.lstrip('.') for ext in SUPPORTED_EXTENSIONS]
-
-def calculate_file_hash(file_path: str) -> str:
-    """计算文件的SHA256哈希值"""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
-
 def get_cached_result(file_hash: str) -> dict | None:
     """获取缓存的转换结果"""
-    cache_file = os.path.join(CACHE_FOLDER, f"{file_hash}.json")
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            # 验证缓存的文件是否存在
-            if os.path.exists(cache_data['markdown_path']):
-                return cache_data
-        except Exception as e:
-            logger.error(f"Error reading cache: {e}")
-    return None
+    return (read_cache_file(storage.sharded_path(CACHE_FOLDER, file_hash, '.json'))
+            # 兼容分片之前的平铺布局
+            or read_cache_file(os.path.join(CACHE_FOLDER, f"{file_hash}.json")))
 
-def save_cache_result(file_hash: str, result: dict):
-    """保存转换结果到缓存"""
-    cache_file = os.path.join(CACHE_FOLDER, f"{file_hash}.json")
-    try:
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f)
-    except Exception as e:
-        logger.error(f"Error saving cache: {e}")
+def get_user_cache_path(user_folders: dict, cache_key: str) -> str:
+    """设备缓存条目的分片路径，只构造路径，不创建目录"""
+    return storage.sharded_path(user_folders['cache'], cache_key, '.json')
+
+def save_user_cache_result(user_folders: dict, cache_key: str, result: dict):
+    """保存转换结果到设备缓存"""
+    cache_path = get_user_cache_path(user_folders, cache_key)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    write_cache_file(cache_path, result)
 
 # 修改文件夹结构，加入设备ID
 def get_user_folders(device_id: str):
-    """获取特定设备的文件夹路径"""
+    """获取特定设备的文件夹路径，按设备ID哈希分片"""
+    device_id = secure_filename(device_id)
     base_folders = {
-        'upload': os.path.join(UPLOAD_FOLDER, device_id),
-        'markdown': os.path.join(MARKDOWN_FOLDER, device_id),
-        'cache': os.path.join(CACHE_FOLDER, device_id),
+        'upload': storage.sharded_path(UPLOAD_FOLDER, device_id),
+        'markdown': storage.sharded_path(MARKDOWN_FOLDER, device_id),
+        'cache': storage.sharded_path(CACHE_FOLDER, device_id),
     }
 
     # 确保所有文件夹存在
@@ -191,6 +159,80 @@ def get_user_folders(device_id: str):
 
     return base_folders
 
+def get_original_stem(filename: str) -> str:
+    """从客户端提供的原始文件名中取出不含目录和扩展名的部分，保留中文等字符"""
+    name = filename.replace('\\', '/').rsplit('/', 1)[-1].replace('\x00', '')
+    # 限制长度，避免超出文件系统的文件名长度限制
+    return os.path.splitext(name)[0].strip().lstrip('.')[:100] or 'document'
+
+def remove_upload(filepath: str, upload_folder: str):
+    """删除已处理的上传文件，批量上传目录中的文件都处理完后删除该目录"""
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    upload_dir = os.path.dirname(filepath)
+    if os.path.abspath(upload_dir) != os.path.abspath(upload_folder):
+        try:
+            os.rmdir(upload_dir)
+        except OSError:
+            # 批次中还有未处理完的文件
+            pass
+
+def check_storage_quota(user_folders: dict):
+    """上传前检查配额，超出时抛出 storage.QuotaExceeded"""
+    storage.check_quota(
+        [user_folders['upload'], user_folders['markdown']],
+        request.content_length or 0,
+        STORAGE_METRICS_PATH
+    )
+
+def get_cache_key(file_hash: str, pages: str | None = None,
+                  split_sheets: bool = False, rows_per_file: int = 0) -> str:
+    """只转换部分页面或切分输出时，缓存键需要带上这些选项"""
+    cache_key = file_hash
+    if pages:
+        cache_key += f"-p{pages}"
+    if split_sheets:
+        cache_key += "-sheets"
+    if rows_per_file:
+        cache_key += f"-r{rows_per_file}"
+    return cache_key
+
+def store_cached_task(cached_result: dict, cache_key: str) -> str:
+    """缓存命中时在结果后端写入一个已完成的任务，状态、预览和下载接口按普通任务处理"""
+    task_id = str(uuid.uuid4())
+    celery.backend.store_result(task_id, {**cached_result, 'cache_key': cache_key}, states.SUCCESS)
+    return task_id
+
+def get_markdown_paths(result: dict) -> list[str]:
+    """转换结果对应的所有 markdown 文件（表格切分时有多个）"""
+    return result.get('parts') or [result['markdown_path']]
+
+def read_markdown_preview(markdown_path: str) -> tuple[str, bool]:
+    """读取预览内容，超过 PREVIEW_MAX_BYTES 时截断"""
+    with open(markdown_path, 'r', encoding='utf-8', errors='ignore') as f:
+        content = f.read(PREVIEW_MAX_BYTES)
+        truncated = bool(f.read(1))
+    return content, truncated
+
+def send_markdown_result(result: dict):
+    """下载转换结果，切分成多个文件时以 ZIP 流返回"""
+    markdown_paths = get_markdown_paths(result)
+    if len(markdown_paths) == 1:
+        return send_file(
+            markdown_paths[0],
+            as_attachment=True,
+            download_name=os.path.basename(markdown_paths[0])
+        )
+
+    stem = os.path.splitext(os.path.basename(result['markdown_path']))[0]
+    return Response(
+        stream_with_context(stream_markdown_zip(
+            [(os.path.basename(path), path) for path in markdown_paths]
+        )),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{stem}.zip"'}
+    )
+
 @app.route('/api/convert', methods=['POST'])
 def convert():
     if 'file' not in request.files:
@@ -208,27 +250,49 @@ def convert():
     if not allowed_file(file.filename):
         return jsonify({'error': 'Unsupported file type'}), 400
 
+    # 可选的页码范围，如 "1-10,15"，仅转换PDF的这些页
+    pages = request.form.get('pages', '').replace(' ', '') or None
+    if pages:
+        if not file.filename.lower().endswith('.pdf'):
+            return jsonify({'error': 'Page ranges are only supported for PDF files'}), 400
+        try:
+            parse_page_range(pages)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    # 表格输出切分：每个工作表一个文件，或每 N 行一个文件
+    split_sheets = request.form.get('splitSheets', '').lower() == 'true'
+    try:
+        rows_per_file = int(request.form.get('rowsPerFile') or 0)
+    except ValueError:
+        return jsonify({'error': 'Invalid rowsPerFile'}), 400
+    if rows_per_file < 0:
+        return jsonify({'error': 'Invalid rowsPerFile'}), 400
+
     # 获取用户特定的文件夹
     user_folders = get_user_folders(device_id)
+    try:
+        check_storage_quota(user_folders)
+    except storage.QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 507
+
     filepath = Path(user_folders['upload']) / secure_filename(file.filename)
     file.save(str(filepath))
 
     file_hash = calculate_file_hash(str(filepath))
-    cache_path = os.path.join(user_folders['cache'], f"{file_hash}.json")
+    cache_key = get_cache_key(file_hash, pages, split_sheets, rows_per_file)
+    cache_path = get_user_cache_path(user_folders, cache_key)
 
     # 检查用户特定的缓存
-    if os.path.exists(cache_path):
-        try:
-            with open(cache_path, 'r') as f:
-                cached_result = json.load(f)
-            return jsonify({
-                'message': 'File conversion completed (cached).',
-                'id': file_hash
-            }), 202
-        except Exception:
-            pass
+    cached_result = read_cache_file(cache_path)
+    if cached_result:
+        os.remove(filepath)
+        return jsonify({
+            'message': 'File conversion completed (cached).',
+            'id': store_cached_task(cached_result, cache_key)
+        }), 202
 
-    task = convert_file.delay(str(filepath), file_hash, device_id)
+    task = convert_file.delay(str(filepath), file_hash, device_id, pages, split_sheets, rows_per_file)
     return jsonify({
         'message': 'File uploaded successfully, conversion in progress.',
         'id': task.id
@@ -264,6 +328,16 @@ def get_status(task_id):
             'preview_url': f'/api/convert/{task_id}/preview',
             'download_url': f'/api/convert/{task_id}/download'
         }
+        if isinstance(task.info, dict) and task.info.get('truncated'):
+            response['description'] = 'Conversion stopped at the time budget, result is incomplete'
+            response['truncated'] = True
+    elif task.state == states.REVOKED:
+        response = {
+            'state': task.state,
+            'progress': 0,
+            'description': 'Conversion cancelled',
+            'error': 'Conversion cancelled'
+        }
     elif task.state == 'FAILURE':
         response = {
             'state': task.state,
@@ -272,25 +346,56 @@ def get_status(task_id):
             'error': str(task.info)
         }
     else:
+        info = task.info if isinstance(task.info, dict) else {}
         response = {
             'state': task.state,
-            'progress': task.info.get('progress', 0) if task.info else 0,
+            'progress': info.get('progress', 0),
             'description': 'Converting file...'
         }
+        if info.get('rows'):
+            response['description'] = f"Converting file... ({info['rows']} rows)"
+            response['rows'] = info['rows']
+        completed_pages = info.get('completed_pages', [])
+        if completed_pages:
+            # 已完成的页面可以提前预览
+            response['description'] = f"Converting file... ({len(completed_pages)}/{info.get('total_pages')} pages)"
+            response['completed_pages'] = len(completed_pages)
+            response['total_pages'] = info.get('total_pages')
+            response['preview_url'] = f'/api/convert/{task_id}/preview'
 
     return jsonify(response)
 
+def read_completed_pages(info: dict, pages: str | None = None) -> tuple[str, list[int]]:
+    """拼接转换中任务已完成的页面，pages 指定时只返回其中已完成的页"""
+    completed_pages = info.get('completed_pages', [])
+    if pages:
+        # total_pages 是本次处理的页数而不是 PDF 的页码上限，只按 MAX_PAGE_NUMBER 截断
+        requested = set(parse_page_range(pages))
+        completed_pages = [p for p in completed_pages if p in requested]
+
+    content = ''
+    for page_number in completed_pages:
+        page_path = os.path.join(info['pages_dir'], f"page_{page_number}.md")
+        if not os.path.exists(page_path):
+            continue
+        with open(page_path, 'r', encoding='utf-8') as f:
+            page_text = f.read()
+        if page_text.strip():
+            content += format_page(page_number, page_text)
+    return content, completed_pages
+
 @app.route('/api/convert/<task_id>/preview')
 def preview_file(task_id):
     # 先检查是否是缓存ID
     cached_result = get_cached_result(task_id)
     if cached_result:
         try:
-            with open(cached_result['markdown_path'], 'r', encoding='utf-8') as f:
-                content = f.read()
+            markdown_path = get_markdown_paths(cached_result)[0]
+            content, truncated = read_markdown_preview(markdown_path)
             return jsonify({
                 'content': content,
-                'filename': os.path.basename(cached_result['markdown_path'])
+                'filename': os.path.basename(markdown_path),
+                'truncated': truncated
             })
         except Exception as e:
             logger.error(f"Error reading cached file: {e}")
@@ -299,6 +404,23 @@ def preview_file(task_id):
     # 如果不是缓存ID，按原来的方式处理
     task = AsyncResult(task_id)
 
+    # 转换中返回已完成的页面
+    if task.state == 'PROGRESS' and isinstance(task.info, dict) and task.info.get('completed_pages'):
+        try:
+            content, completed_pages = read_completed_pages(task.info, request.args.get('pages'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error reading completed pages: {e}")
+            return jsonify({'error': str(e)}), 500
+        return jsonify({
+            'content': content,
+            'filename': task.info.get('filename'),
+            'partial': True,
+            'pages': completed_pages,
+            'total_pages': task.info.get('total_pages')
+        })
+
     if task.state != 'SUCCESS':
         return jsonify({'error': 'Conversion not completed'}), 400
 
@@ -306,11 +428,12 @@ def preview_file(task_id):
         return jsonify({'error': 'Markdown file not found'}), 404
 
     try:
-        with open(task.info['markdown_path'], 'r', encoding='utf-8') as f:
-            content = f.read()
+        markdown_path = get_markdown_paths(task.info)[0]
+        content, truncated = read_markdown_preview(markdown_path)
         return jsonify({
             'content': content,
-            'filename': os.path.basename(task.info['markdown_path'])
+            'filename': os.path.basename(markdown_path),
+            'truncated': truncated
         })
     except Exception as e:
         logger.error(f"Error reading markdown file: {e}")
@@ -321,11 +444,7 @@ def download_file(task_id):
     # 先检查是否是缓存ID
     cached_result = get_cached_result(task_id)
     if cached_result:
-        return send_file(
-            cached_result['markdown_path'],
-            as_attachment=True,
-            download_name=os.path.basename(cached_result['markdown_path'])
-        )
+        return send_markdown_result(cached_result)
 
     # 如果不是缓存ID，按原来的方式处理
     task = AsyncResult(task_id)
@@ -336,11 +455,48 @@ def download_file(task_id):
     if not task.info or 'markdown_path' not in task.info:
         return jsonify({'error': 'Markdown file not found'}), 404
 
-    return send_file(
-        task.info['markdown_path'],
-        as_attachment=True,
-        download_name=os.path.basename(task.info['markdown_path'])
-    )
+    return send_markdown_result(task.info)
+
+def get_task_metas(task_ids: list[str]) -> dict[str, dict]:
+    """通过结果后端的批量读取获取多个任务的结果"""
+    if not task_ids:
+        return {}
+    backend = celery.backend
+    try:
+        values = backend.mget([backend.get_key_for_task(task_id) for task_id in task_ids])
+    except Exception as e:
+        logger.warning(f"Failed to fetch task results: {e}")
+        return {}
+    return {
+        task_id: backend.decode_result(value)
+        for task_id, value in zip(task_ids, values)
+        if value
+    }
+
+def cancel_tasks(task_ids: list[str]):
+    """撤销排队中的任务，并为运行中的任务设置取消标记"""
+    if not task_ids:
+        return
+    celery.control.revoke(task_ids)
+    try:
+        with celery.backend.client.pipeline() as pipe:
+            for task_id in task_ids:
+                pipe.set(f"{CANCEL_KEY_PREFIX}{task_id}", 1, ex=CANCEL_FLAG_TTL)
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to set cancel flags: {e}")
+
+def is_task_cancelled(task_id: str) -> bool:
+    try:
+        return bool(celery.backend.client.exists(f"{CANCEL_KEY_PREFIX}{task_id}"))
+    except Exception as e:
+        logger.warning(f"Failed to read cancel flag for task {task_id}: {e}")
+        return False
+
+@app.route('/api/convert/<task_id>/cancel', methods=['POST'])
+def cancel_conversion(task_id):
+    cancel_tasks([task_id])
+    return jsonify({'message': 'Cancellation requested', 'id': task_id}), 202
 
 @app.route('/api/convert/clear-history', methods=['POST'])
 def clear_history():
@@ -354,420 +510,485 @@ def clear_history():
 
         user_folders = get_user_folders(device_id)
 
+        # 一次性批量读取所有任务结果，而不是逐个查询
+        task_metas = get_task_metas(task_ids)
+
+        # 清除历史时停止仍在排队或运行的任务
+        cancel_tasks([
+            task_id for task_id in task_ids
+            if task_metas.get(task_id, {}).get('status') not in states.READY_STATES
+        ])
+
         # 删除用户特定的文件和缓存
         for task_id in task_ids:
-            # 删除缓存
-            cache_file = os.path.join(user_folders['cache'], f"{task_id}.json")
-            if os.path.exists(cache_file):
-                os.remove(cache_file)
-
-            # 获取并删除markdown文件
-            try:
-                task_result = AsyncResult(task_id)
-                if task_result.successful():
-                    markdown_path = task_result.info.get('markdown_path')
-                    if markdown_path and os.path.exists(markdown_path):
+            markdown_paths = []
+
+            # 删除缓存（旧版本缓存命中时任务ID就是缓存键），任务ID来自客户端，不能含路径分隔符
+            if os.path.basename(task_id) == task_id and task_id not in ('.', '..'):
+                cache_file = get_user_cache_path(user_folders, task_id)
+                cached_result = read_cache_file(cache_file)
+                if cached_result:
+                    markdown_paths.extend(get_markdown_paths(cached_result))
+                if os.path.exists(cache_file):
+                    os.remove(cache_file)
+
+            meta = task_metas.get(task_id)
+            if meta and meta.get('status') == 'SUCCESS' and isinstance(meta.get('result'), dict):
+                markdown_paths.extend(meta['result'].get('parts') or [meta['result'].get('markdown_path')])
+                # 任务结果记录了对应的缓存键
+                if meta['result'].get('cache_key'):
+                    result_cache_file = get_user_cache_path(user_folders, meta['result']['cache_key'])
+                    if os.path.exists(result_cache_file):
+                        os.remove(result_cache_file)
+
+            # 删除markdown文件，对应的缓存条目由存储清理任务回收；
+            # 全局缓存可能指向命令行工具写入的用户输出目录，只删除存储目录下的文件
+            for markdown_path in markdown_paths:
+                try:
+                    if (markdown_path and storage.is_within(markdown_path, MARKDOWN_FOLDER)
+                            and os.path.exists(markdown_path)):
                         os.remove(markdown_path)
-            except Exception as e:
-                logger.warning(f"Failed to remove file for task {task_id}: {e}")
+                except Exception as e:
+                    logger.warning(f"Failed to remove file for task {task_id}: {e}")
 
         return jsonify({'message': 'History cleared successfully'}), 200
     except Exception as e:
         logger.error(f"Error clearing history: {e}")
         return jsonify({'error': str(e)}), 500
 
-def is_valid_content(content: str) -> bool:
-    """验证提取的内容是否有效"""
-    # 移除空白字符后的最小有效长度
-    MIN_CONTENT_LENGTH = 50
-
-    if not content or len(content.strip()) < MIN_CONTENT_LENGTH:
-        return False
-
-    # Anna's Archive 元数据特征识别
-    anna_archive_indicators = [
-        "Document generated by Anna",
-        "Anna's Archive",
-        "DuXiu collection",
-        "annas-blog.org",
-        "pdg_dir_name",
-        "pdg_main_pages",
-        "pdf_generation_missing_pages",
-        '"filename_decoded"',
-        '"total_pixels"',
-        '"zip_password"'
-    ]
-
-    # 检查是否包含典型的JSON字段组合
-    json_field_combinations = [
-        ('filesize', 'md5', 'sha1'),
-        ('crc32', 'uncompressed_size'),
-        ('header_md5', 'sha256')
-    ]
-
-    # 计算 Anna's Archive 指标出现次数
-    anna_indicators_count = sum(1 for indicator in anna_archive_indicators if indicator in content)
-
-    # 检查 JSON 字段组合
-    json_combinations_present = any(
-        all(field in content for field in combination)
-        for combination in json_field_combinations
-    )
-
-    # 如果包含多个 Anna's Archive 特征或特定的 JSON 字段组合，认为是元数据
-    if anna_indicators_count >= 2 or json_combinations_present:
-        logger.info(f"Detected Anna's Archive metadata: {anna_indicators_count} indicators, JSON fields: {json_combinations_present}")
-        return False
-
-    # 判断是否是广告或垃圾信息
-    spam_keywords = [
-        "开户客服微信",
-        "扫描二维码",
-        "手续费",
-        "股票期货",
-        "无门槛",
-        "加微信",
-        "国企证券",
-        "万一",
-        "开股票账户",
-        "开期货账户",
-        '账户',
-        "加一分",
-        "国企期货",
-        '期货',
-        "书籍下载",
-        "点击网站链接",
-        "二维码添加微信",
-    ]
-
-    # 计算垃圾关键词出现的次数
-    spam_count = sum(1 for keyword in spam_keywords if keyword in content)
-    # 如果出现超过2个关键词，认为是垃圾信息
-    if (spam_count > 1):
-        return False
-
-    # 检查是否包含足够的中文字符
-    chinese_chars = len([c for c in content if '\u4e00' <= c <= '\u9fff'])
-    if chinese_chars > 0:
-        # 如果包含中文，要求中文字符至少占10%
-        if chinese_chars / len(content.strip()) < 0.1:
-            return False
-
-    return True
-
-def enhance_image_quality(image_path):
-    """增强图片质量"""
-    # 读取图片
-    img = cv2.imread(image_path)
-    if img is None:
-        return False
-
+def get_user_cached_result(user_folders: dict, file_hash: str) -> dict | None:
+    """获取设备缓存中的转换结果"""
+    return read_cache_file(get_user_cache_path(user_folders, file_hash)) or get_cached_result(file_hash)
+
+def save_batch_manifest(batch_id: str, manifest: dict):
+    """保存批量任务清单"""
+    manifest_path = storage.sharded_path(BATCH_FOLDER, batch_id, '.json')
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+def load_batch_manifest(batch_id: str) -> dict | None:
+    """读取批量任务清单"""
+    manifest_path = storage.sharded_path(BATCH_FOLDER, secure_filename(batch_id), '.json')
+    if not os.path.exists(manifest_path):
+        return None
     try:
-        # 转换为灰度图
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # 自适应阈值二值化
-        binary = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY, 11, 2
-        )
-
-        # 降噪
-        denoised = cv2.fastNlMeansDenoising(binary)
-
-        # 提高对比度
-        enhanced = cv2.convertScaleAbs(denoised, alpha=1.2, beta=0)
-
-        # 锐化
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
-        sharpened = cv2.filter2D(enhanced, -1, kernel)
-
-        # 调整亮度和对比度
-        bright = cv2.convertScaleAbs(sharpened, alpha=1.1, beta=10)
-
-        # 保存增强后的图片
-        enhanced_path = image_path.replace('.png', '_enhanced.png')
-        cv2.imwrite(enhanced_path, bright)
-
-        return enhanced_path
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
     except Exception as e:
-        logger.error(f"Image enhancement failed: {e}")
-        return False
-
-# 初始化PaddleOCR（在全局变量区域）
-paddle_ocr = PaddleOCR(use_angle_cls=True, lang='ch', use_gpu=False)
-logger.info("PaddleOCR initialized successfully")
+        logger.error(f"Error reading batch manifest: {e}")
+        return None
+
+def get_batch_item_states(items: list[dict]) -> list[tuple[str, float, list[str]]]:
+    """返回批量任务中每个文件的 (状态, 进度, markdown路径列表)，任务结果一次批量读取"""
+    task_metas = get_task_metas([item['id'] for item in items if not item.get('markdown_path')])
+    item_states = []
+    for item in items:
+        if item.get('markdown_path'):
+            item_states.append(('SUCCESS', 100, get_markdown_paths(item)))
+            continue
+
+        # 结果后端中还没有记录的任务仍在排队
+        meta = task_metas.get(item['id']) or {}
+        state = meta.get('status', states.PENDING)
+        info = meta.get('result')
+        if state == states.SUCCESS:
+            item_states.append((state, 100, get_markdown_paths(info) if isinstance(info, dict) else []))
+        elif state == 'PROGRESS' and isinstance(info, dict):
+            item_states.append((state, info.get('progress', 0), []))
+        else:
+            item_states.append((state, 0, []))
+    return item_states
+
+@app.route('/api/convert/batch', methods=['POST'])
+def convert_batch():
+    """批量转换：上传多个文件，或提交已上传文件的哈希清单，创建一个任务组"""
+    data = request.get_json(silent=True) or {}
+    device_id = request.form.get('deviceId') or data.get('deviceId')
 
-def process_image_with_paddle_ocr(image_path):
-    """使用PaddleOCR处理图片"""
-    try:
-        logger.info(f"Processing image with PaddleOCR: {image_path}")
-        result = paddle_ocr.ocr(image_path, cls=True)
-
-        if not result or not result[0]:
-            logger.warning("PaddleOCR returned empty result")
-            return ""
+    if not device_id:
+        return jsonify({'error': 'No device ID provided'}), 400
 
-        # 提取识别的文本
-        text_content = []
-        for line in result[0]:
-            if len(line) >= 2:  # 确保结果包含文本部分
-                text_content.append(line[1][0])  # 获取识别的文本内容
+    files = request.files.getlist('files') or request.files.getlist('file')
+    hashes = data.get('hashes', [])
+    if not isinstance(hashes, list):
+        return jsonify({'error': 'hashes must be a list'}), 400
 
-        return "\n".join(text_content)
-    except Exception as e:
-        logger.error(f"PaddleOCR processing failed: {e}")
-        return ""
+    if not files and not hashes:
+        return jsonify({'error': 'No files or hashes provided'}), 400
 
-@celery.task(bind=True)
-def convert_file(self, filepath: str, file_hash: str, device_id: str):
+    user_folders = get_user_folders(device_id)
     try:
-        user_folders = get_user_folders(device_id)
-
-        logger.info(f"Starting conversion for file: {filepath}")
-
-        # 检查文件是否存在
-        if not os.path.exists(filepath):
-            logger.error(f"File not found: {filepath}")
-            raise Exception("File not found")
-
-        # 更新任务进度为10%
-        self.update_state(state='PROGRESS', meta={'progress': 10})
+        check_storage_quota(user_folders)
+    except storage.QuotaExceeded as e:
+        return jsonify({'error': str(e)}), 507
+
+    # 每个批次单独的上传目录
+    upload_dir = Path(user_folders['upload']) / uuid.uuid4().hex
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    items = []
+    signatures = []
+    missing = []
+    rejected = []
+
+    for file in files:
+        if file.filename == '' or not allowed_file(file.filename):
+            rejected.append(file.filename)
+            continue
+
+        # 按序号保存，只保留扩展名：同一批次中的同名文件不会互相覆盖，
+        # secure_filename 也会把纯中文文件名（如 报告一.pdf）变成没有扩展名的 "pdf"
+        filepath = upload_dir / f"{len(items)}{os.path.splitext(file.filename)[1].lower()}"
+        file.save(str(filepath))
+        file_hash = calculate_file_hash(str(filepath))
+
+        cached_result = get_user_cached_result(user_folders, file_hash)
+        if cached_result:
+            os.remove(filepath)
+            items.append({
+                'filename': file.filename,
+                'hash': file_hash,
+                'id': store_cached_task(cached_result, file_hash),
+                'markdown_path': cached_result['markdown_path'],
+                'parts': cached_result.get('parts')
+            })
+            continue
+
+        items.append({'filename': file.filename, 'hash': file_hash, 'id': None})
+        signatures.append((len(items) - 1, convert_file.s(
+            str(filepath), file_hash, device_id, original_filename=file.filename
+        )))
+
+    if not signatures:
+        # 全部命中缓存或被拒绝，批次目录已无用
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    # 哈希清单只能引用已有转换结果，未命中的需要客户端重新上传
+    for file_hash in hashes:
+        # 哈希会拼进缓存路径，只接受 SHA256 十六进制串
+        if not isinstance(file_hash, str) or not FILE_HASH_PATTERN.match(file_hash):
+            rejected.append(file_hash)
+            continue
+        cached_result = get_user_cached_result(user_folders, file_hash)
+        if not cached_result:
+            missing.append(file_hash)
+            continue
+        items.append({
+            'filename': os.path.basename(cached_result['markdown_path']),
+            'hash': file_hash,
+            'id': store_cached_task(cached_result, file_hash),
+            'markdown_path': cached_result['markdown_path'],
+            'parts': cached_result.get('parts')
+        })
 
-        # 先尝试使用 MarkItDown 转换
-        logger.info("Attempting conversion with MarkItDown...")
-        result = md.convert(filepath)
-        content = result.text_content
-        logger.debug(f"Initial conversion result: {content[:200]}...")
-        logger.info(f"Content starts with: {content[:50]}")  # 添加调试日志
+    if not items:
+        return jsonify({
+            'error': 'No convertible files in batch',
+            'rejected': rejected,
+            'missing': missing
+        }), 400
+
+    if signatures:
+        group_result = group(signature for _, signature in signatures).apply_async()
+        group_result.save()
+        batch_id = group_result.id
+        for (index, _), task in zip(signatures, group_result.results):
+            items[index]['id'] = task.id
+    else:
+        batch_id = str(uuid.uuid4())
 
-        # 验证 MarkItDown 转换的内容
-        valid_content = is_valid_content(content)
-        logger.info(f"Content validation result: {valid_content}")  # 添加调试日志
+    save_batch_manifest(batch_id, {
+        'id': batch_id,
+        'device_id': device_id,
+        'created_at': time.time(),
+        'items': items
+    })
 
-        if not valid_content:
-            logger.warning("MarkItDown content validation failed, trying OCR...")
-            file_extension = os.path.splitext(filepath)[1].lower()
+    return jsonify({
+        'message': 'Batch accepted, conversion in progress.',
+        'id': batch_id,
+        'items': [{'filename': item['filename'], 'id': item['id']} for item in items],
+        'rejected': rejected,
+        'missing': missing
+    }), 202
 
-            if file_extension == '.pdf':
-                try:
-                    logger.info("Converting PDF to images for OCR processing...")
-                    content = ''
-
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        # 将PDF转换为图像
-                        images = convert_from_path(filepath)
-                        total_images = len(images)
-
-                        # 创建调试目录
-                        debug_subdir = os.path.join(DEBUG_FOLDER, os.path.splitext(os.path.basename(filepath))[0])
-                        os.makedirs(debug_subdir, exist_ok=True)
-                        logger.info(f"Debug images will be saved to: {debug_subdir}")
-
-                        for i, image in enumerate(images):
-                            logger.info(f"Processing page {i+1}/{total_images}")
-                            progress = 10 + (80 * i / total_images)
-                            self.update_state(state='PROGRESS', meta={'progress': progress})
-
-                            # 保存图像到临时文件和调试目录
-                            temp_image = os.path.join(temp_dir, f'page_{i}.png')
-                            debug_image = os.path.join(debug_subdir, f'page_{i}.png')
-                            image.save(temp_image, 'PNG')
-                            image.save(debug_image, 'PNG')
-                            logger.info(f"Saved debug image: {debug_image}")
-
-                            # 增强图片质量
-                            enhanced_image = enhance_image_quality(temp_image)
-                            if enhanced_image:
-                                logger.info(f"Successfully enhanced image quality")
-                                enhanced_debug = os.path.join(debug_subdir, f'page_{i}_enhanced.png')
-                                import shutil
-                                shutil.copy2(enhanced_image, enhanced_debug)
-                                # 使用增强后的图片进行OCR
-                                temp_image = enhanced_image
-
-                            # 修改OCR处理部分
-                            try:
-                                logger.info("Starting multi-stage OCR process...")
-
-                                # 1. 首先尝试Tesseract
-                                logger.info("1. Attempting Tesseract OCR...")
-                                tesseract_text = pytesseract.image_to_string(temp_image, lang='chi_sim+eng')
-
-                                # 2. 尝试PaddleOCR
-                                logger.info("2. Attempting PaddleOCR...")
-                                paddle_text = process_image_with_paddle_ocr(temp_image)
-
-                                # 3. 选择最佳结果
-                                if is_valid_content(tesseract_text):
-                                    logger.info("Using Tesseract OCR result")
-                                    page_text = tesseract_text
-                                elif is_valid_content(paddle_text):
-                                    logger.info("Using PaddleOCR result")
-                                    page_text = paddle_text
-                                else:
-                                    # 4. 如果两者都不理想，使用GPT-4V
-                                    logger.info("Local OCR results not satisfactory, trying GPT-4V...")
-                                    try:
-                                        with open(temp_image, 'rb') as img_file:
-                                            # GPT-4V处理代码保持不变
-                                            logger.info(f"Making API request to: {client.base_url}/chat/completions")  # 添加这行
-                                            with open(temp_image, 'rb') as img_file:
-                                                # 记录图片大小
-                                                img_file.seek(0, 2)
-                                                file_size = img_file.tell()
-                                                img_file.seek(0)
-                                                logger.info(f"Processing image size: {file_size/1024/1024:.2f}MB")
-
-                                                response = client.chat.completions.create(
-                                                    model=os.getenv('OPENAI_LLM_MODEL', 'gpt-4-vision-preview'),
-                                                    messages=[
-                                                        {
-                                                            "role": "user",
-                                                            "content": [
-                                                                {
-                                                                    "type": "text",
-                                                                    "text": "请识别这个图片中的所有文字内容。如果发现表格，请转换为Markdown表格格式。请保持原始的段落结构和格式。"
-                                                                },
-                                                                {
-                                                                    "type": "image_url",
-                                                                    "image_url": {
-                                                                        "url": f"data:image/png;base64,{base64.b64encode(img_file.read()).decode('utf-8')}"
-                                                                    }
-                                                                }
-                                                            ]
-                                                        }
-                                                    ],
-                                                )
-
-                                                # 处理返回的文本
-                                                page_text = response.choices[0].message.content
-                                                logger.info(f"OCR Result Preview: {page_text[:200]}...")  # 打印前200个字符
-                                                logger.info(f"OCR Result Length: {len(page_text)}")
-
-                                                if page_text.strip():
-                                                    content += f"## Page {i+1}\n\n{page_text}\n\n"
-                                                else:
-                                                    logger.warning(f"Empty OCR result for page {i+1}")
-                                                    # 保存失败的请求信息
-                                                    with open(os.path.join(debug_subdir, f'failed_request_page_{i+1}.txt'), 'w') as f:
-                                                        f.write(f"Response: {response}\n")
-                                                        f.write(f"Content: {page_text}")
-
-                                    except Exception as gpt_error:
-                                        logger.error(f"GPT-4V processing error: {gpt_error}")
-                                        # 如果GPT-4V失败，使用Tesseract的结果
-                                        page_text = tesseract_text or paddle_text or "OCR处理失败"
-
-                                # 保存识别结果
-                                if page_text.strip():
-                                    content += f"## Page {i+1}\n\n{page_text}\n\n"
-                                    # 保存调试信息
-                                    debug_info = {
-                                        'tesseract_result': tesseract_text,
-                                        'paddle_result': paddle_text,
-                                        'final_result': page_text
-                                    }
-                                    with open(os.path.join(debug_subdir, f'ocr_debug_page_{i+1}.json'), 'w', encoding='utf-8') as f:
-                                        json.dump(debug_info, f, ensure_ascii=False, indent=2)
-                                else:
-                                    logger.warning(f"Empty OCR result for page {i+1}")
-
-                            except Exception as ocr_error:
-                                logger.error(f"OCR processing error on page {i+1}: {ocr_error}")
-                                with open(os.path.join(debug_subdir, f'error_log_page_{i+1}.txt'), 'w') as f:
-                                    f.write(f"Error: {str(ocr_error)}\n")
-                                continue
-
-                    # 检查最终结果
-                    if content.strip():
-                        logger.info(f"Total extracted content length: {len(content)}")
-                        logger.info("Content preview:")
-                        logger.info(content[:500])  # 打印前500个字符
-                    else:
-                        logger.error("No content extracted from OCR")
-                        raise Exception("No content extracted from PDF via OCR")
-
-                    # 保存完整的OCR结果用于调试
-                    with open(os.path.join(debug_subdir, 'full_ocr_result.txt'), 'w', encoding='utf-8') as f:
-                        f.write(content)
+@app.route('/api/batch/<batch_id>/status')
+def get_batch_status(batch_id):
+    manifest = load_batch_manifest(batch_id)
+    if not manifest:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    state_counts = {}
+    items = []
+    total_progress = 0
+    for item, (state, progress, _) in zip(manifest['items'], get_batch_item_states(manifest['items'])):
+        state_counts[state] = state_counts.get(state, 0) + 1
+        total_progress += progress
+        items.append({
+            'id': item['id'],
+            'filename': item['filename'],
+            'state': state,
+            'progress': progress
+        })
 
-                except Exception as e:
-                    logger.error(f"Error in PDF processing: {str(e)}", exc_info=True)
-                    raise Exception(f"PDF processing failed: {str(e)}")
+    total = len(items)
+    completed = state_counts.get(states.SUCCESS, 0)
+    failed = state_counts.get(states.FAILURE, 0)
+    # 已取消的文件不会再有结果，与失败一样视为结束
+    cancelled = state_counts.get(states.REVOKED, 0)
+    if completed == total:
+        state = 'SUCCESS'
+    elif completed + failed + cancelled == total:
+        if completed:
+            state = 'PARTIAL'
+        else:
+            state = states.REVOKED if cancelled else 'FAILURE'
+    else:
+        state = 'PROGRESS'
+
+    response = {
+        'id': batch_id,
+        'state': state,
+        'progress': total_progress / total if total else 0,
+        'total': total,
+        'completed': completed,
+        'failed': failed,
+        'cancelled': cancelled,
+        'items': items
+    }
+    if completed:
+        response['download_url'] = f'/api/batch/{batch_id}/download'
+    return jsonify(response)
 
-            elif file_extension == '.zip':
-                try:
-                    logger.info("Detected metadata in ZIP result, trying direct extraction...")
-                    import zipfile
-                    with zipfile.ZipFile(filepath, 'r') as zip_ref:
-                        # 获取所有文本文件
-                        text_files = [f for f in zip_ref.namelist() if f.endswith('.txt')]
-                        content = ''
-                        for txt_file in text_files:
-                            with zip_ref.open(txt_file) as f:
-                                content += f.read().decode('utf-8', errors='ignore') + '\n\n'
-
-                        if not content.strip():
-                            # 如果没有找到文本文件，尝试其他类型的文件
-                            for f in zip_ref.namelist():
-                                if not f.endswith(('.jpg', '.png', '.gif')):  # 跳过图片文件
-                                    try:
-                                        with zip_ref.open(f) as file:
-                                            content += f'# {f}\n\n'
-                                            content += file.read().decode('utf-8', errors='ignore') + '\n\n'
-                                    except:
-                                        continue
-                    logger.info("Successfully extracted ZIP content")
-                except Exception as e:
-                    logger.error(f"Error extracting ZIP content: {e}")
-                    # 如果提取失败，保留原始内容
-                    content = result.text_content
+@app.route('/api/batch/<batch_id>/cancel', methods=['POST'])
+def cancel_batch(batch_id):
+    manifest = load_batch_manifest(batch_id)
+    if not manifest:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    # 命中缓存的文件没有任务
+    task_ids = [item['id'] for item in manifest['items'] if not item.get('markdown_path')]
+    cancel_tasks(task_ids)
+    return jsonify({'message': 'Cancellation requested', 'id': batch_id, 'cancelled': len(task_ids)}), 202
+
+class ZipStreamBuffer:
+    """供 zipfile 写入的只追加缓冲区，由生成器逐块取出数据"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_markdown_zip(entries: list[tuple[str, str]], chunk_size: int = 64 * 1024):
+    """逐块生成包含所有 markdown 文件的 ZIP，不在内存中构建完整压缩包"""
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for arcname, markdown_path in entries:
+            with open(markdown_path, 'rb') as src, zip_file.open(arcname, 'w') as dest:
+                for block in iter(lambda: src.read(chunk_size), b''):
+                    dest.write(block)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
+
+@app.route('/api/batch/<batch_id>/download')
+def download_batch(batch_id):
+    manifest = load_batch_manifest(batch_id)
+    if not manifest:
+        return jsonify({'error': 'Batch not found'}), 404
+
+    entries = []
+    used_names = set()
+    for state, _, markdown_paths in get_batch_item_states(manifest['items']):
+        if state != 'SUCCESS':
+            continue
+
+        for markdown_path in markdown_paths:
+            if not os.path.exists(markdown_path):
+                continue
+
+            # 同名文件追加序号，避免压缩包内覆盖
+            stem, ext = os.path.splitext(os.path.basename(markdown_path))
+            arcname = f"{stem}{ext}"
+            counter = 1
+            while arcname in used_names:
+                arcname = f"{stem}_{counter}{ext}"
+                counter += 1
+            used_names.add(arcname)
+            entries.append((arcname, markdown_path))
+
+    if not entries:
+        return jsonify({'error': 'Conversion not completed'}), 400
 
-        # 最终检查内容
-        if not content or len(content.strip()) == 0:
-            logger.error("No content extracted from file")
-            raise Exception("Failed to extract content from file")
+    return Response(
+        stream_with_context(stream_markdown_zip(entries)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{batch_id}.zip"'}
+    )
 
-        # 存为markdown文件
-        source_path = Path(filepath)
-        filename = f"{source_path.stem}.md"  # 保留完整的文件名
-        markdown_path = os.path.join(user_folders['markdown'], filename)
-        logger.info(f"Writing content to {markdown_path}")
+@celery.task(bind=True)
+def convert_file(self, filepath: str, file_hash: str, device_id: str, pages: str | None = None,
+                 split_sheets: bool = False, rows_per_file: int = 0, original_filename: str | None = None):
+    """original_filename 为上传时的原始文件名；给出时结果写入按任务ID区分的子目录，
+    文件名取自原始文件名，不会与其他任务的同名结果冲突"""
+    user_folders = get_user_folders(device_id)
+    source_path = Path(filepath)
+    # 逐页结果目录，供转换过程中预览
+    pages_dir = os.path.join(user_folders['markdown'], f"{self.request.id}.pages")
+    try:
+        if original_filename:
+            stem = get_original_stem(original_filename)
+            markdown_dir = os.path.join(user_folders['markdown'], self.request.id)
+        else:
+            stem = source_path.stem
+            markdown_dir = user_folders['markdown']
+        filename = f"{stem}_p{pages}.md" if pages else f"{stem}.md"  # 保留完整的文件名
+        meta = {
+            'progress': 0,
+            'filename': filename,
+            'pages_dir': pages_dir,
+            'completed_pages': [],
+            'total_pages': None
+        }
 
-        # 写入文件
-        with open(markdown_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        control = ConversionControl(is_cancelled=lambda: is_task_cancelled(self.request.id))
+
+        def on_progress(progress: float):
+            meta['progress'] = progress
+            self.update_state(state='PROGRESS', meta=meta)
+
+        def on_page(page_number: int, page_text: str, total_pages: int):
+            os.makedirs(pages_dir, exist_ok=True)
+            with open(os.path.join(pages_dir, f"page_{page_number}.md"), 'w', encoding='utf-8') as f:
+                f.write(page_text)
+            meta['completed_pages'].append(page_number)
+            meta['total_pages'] = total_pages
+            self.update_state(state='PROGRESS', meta=meta)
+
+        markdown_path = os.path.join(markdown_dir, filename)
+
+        if source_path.suffix.lower() in SPREADSHEET_EXTENSIONS:
+            # 表格逐行流式写出，不在内存中构建整张表
+            def on_rows(progress: float, rows: int):
+                control.check()
+                meta['progress'] = progress
+                meta['rows'] = rows
+                self.update_state(state='PROGRESS', meta=meta)
+
+            on_progress(10)
+            # 转换开始后设备目录可能已被清理任务当作空目录删除
+            os.makedirs(markdown_dir, exist_ok=True)
+            markdown_paths = convert_spreadsheet(
+                filepath,
+                markdown_path,
+                progress_callback=on_rows,
+                split_sheets=split_sheets,
+                rows_per_file=rows_per_file
+            )
+        else:
+            content = convert_document(
+                filepath,
+                debug_folder=storage.sharded_path(DEBUG_FOLDER, file_hash),
+                progress_callback=on_progress,
+                pages=parse_page_range(pages) if pages else None,
+                page_callback=on_page,
+                control=control
+            )
+
+            # 存为markdown文件
+            logger.info(f"Writing content to {markdown_path}")
+
+            # 写入文件，转换期间设备目录可能已被清理任务当作空目录删除
+            os.makedirs(markdown_dir, exist_ok=True)
+            with open(markdown_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            markdown_paths = [markdown_path]
 
         # 清理原始文件
         try:
-            os.remove(filepath)
+            remove_upload(filepath, user_folders['upload'])
             logger.info(f"Successfully removed original file: {filepath}")
         except Exception as e:
             logger.warning(f"Failed to remove original file {filepath}: {e}")
 
         result = {
             'status': 'success',
-            'markdown_path': markdown_path
+            'markdown_path': markdown_paths[0]
         }
+        if len(markdown_paths) > 1:
+            result['parts'] = markdown_paths
+
+        if control.truncated:
+            # 超出时间预算只转换了部分页面：条目带 truncated 标记，查找缓存时忽略，
+            # 下次上传重新转换；清理任务仍按条目保留文件直到过期
+            result['truncated'] = True
 
         # 保存结果到用户特定的缓存
-        cache_path = os.path.join(user_folders['cache'], f"{file_hash}.json")
-        save_cache_result(cache_path, result)
+        cache_key = get_cache_key(file_hash, pages, split_sheets, rows_per_file)
+        save_user_cache_result(user_folders, cache_key, result)
+
+        return {**result, 'cache_key': cache_key}
 
-        return result
+    except ConversionCancelled:
+        logger.info(f"Conversion cancelled: {filepath}")
+        remove_upload(filepath, user_folders['upload'])
+        self.backend.mark_as_revoked(self.request.id, reason='cancelled', request=self.request)
+        raise Ignore()
 
     except Exception as e:
         logger.error(f"Error processing file {filepath}: {e}", exc_info=True)
         # 清理文件
         try:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-                logger.info(f"Cleaned up file {filepath}")
+            remove_upload(filepath, user_folders['upload'])
+            logger.info(f"Cleaned up file {filepath}")
         except Exception as cleanup_error:
             logger.warning(f"Failed to clean up file {filepath}: {cleanup_error}")
         raise Exception(str(e))
 
+    finally:
+        # 完整结果已写入或任务失败，逐页结果不再需要
+        shutil.rmtree(pages_dir, ignore_errors=True)
+
+@celery.task(name='sweep_storage')
+def sweep_storage():
+    """定期回收过期上传、孤立 markdown、失效缓存和旧调试页"""
+    return storage.sweep(
+        upload_root=UPLOAD_FOLDER,
+        markdown_root=MARKDOWN_FOLDER,
+        cache_root=CACHE_FOLDER,
+        debug_root=DEBUG_FOLDER,
+        batch_root=BATCH_FOLDER,
+        metrics_path=STORAGE_METRICS_PATH
+    )
+
+celery.conf.beat_schedule = {
+    'sweep-storage': {
+        'task': 'sweep_storage',
+        'schedule': timedelta(seconds=int(os.getenv('STORAGE_SWEEP_INTERVAL_SECONDS', '3600'))),
+    },
+}
+
+@app.route('/metrics')
+def metrics():
+    return Response(
+        storage.render_prometheus_metrics(storage.load_metrics(STORAGE_METRICS_PATH)),
+        mimetype='text/plain; version=0.0.4'
+    )
+
 @app.route('/')
 def health_check():
     return jsonify({'status': 'healthy'}), 200
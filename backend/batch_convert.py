@@ -0,0 +1,256 @@
+"""命令行批量转换：不依赖 Flask/Celery/Redis，使用进程池转换整个目录树
+
+用法:
+    python -m batch_convert INPUT_DIR OUTPUT_DIR [--workers N] [--cache-dir DIR]
+
+每个文件完成后追加一行到清单（默认 OUTPUT_DIR/manifest.jsonl），
+中断后重新运行同一命令会跳过清单中已成功的文件。
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from converter import (
+    SUPPORTED_EXTENSIONS,
+    ConversionControl,
+    calculate_file_hash,
+    convert_document,
+    read_cache_file,
+    write_cache_file,
+)
+from spreadsheet import SPREADSHEET_EXTENSIONS, convert_spreadsheet
+from storage import sharded_path
+
+logger = logging.getLogger(__name__)
+
+def iter_source_files(input_dir: Path, exclude: Path | None = None):
+    """遍历目录树中所有支持的文件，跳过 exclude 目录（输出目录位于输入目录内时）"""
+    for root, dirnames, filenames in os.walk(input_dir):
+        if exclude is not None:
+            dirnames[:] = [d for d in dirnames if (Path(root) / d).resolve() != exclude.resolve()]
+        for filename in sorted(filenames):
+            if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                yield Path(root) / filename
+
+def load_manifest(manifest_path: Path) -> dict:
+    """读取清单，返回 {相对路径: 记录}，同一文件以最后一条记录为准"""
+    records = {}
+    if not manifest_path.exists():
+        return records
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断时可能留下半行，忽略即可
+                continue
+            records[record['source']] = record
+    return records
+
+def convert_one(source: str, relative: str, output_path: str,
+                cache_dir: str | None, debug_dir: str | None) -> dict:
+    """在子进程中转换单个文件，返回清单记录"""
+    started = time.perf_counter()
+    record = {'source': relative, 'output': output_path}
+    try:
+        file_hash = calculate_file_hash(source)
+        record['hash'] = file_hash
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        # 与 Web 服务相同的分片缓存布局
+        cache_file = sharded_path(cache_dir, file_hash, '.json') if cache_dir else None
+        cached_result = read_cache_file(cache_file) if cache_file else None
+        if cached_result:
+            if os.path.abspath(cached_result['markdown_path']) != os.path.abspath(output_path):
+                shutil.copyfile(cached_result['markdown_path'], output_path)
+            record['status'] = 'cached'
+        else:
+            if source.lower().endswith(SPREADSHEET_EXTENSIONS):
+                # 大表格逐行流式写出
+                convert_spreadsheet(source, output_path)
+            else:
+                control = ConversionControl()
+                content = convert_document(source, debug_folder=debug_dir, control=control)
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                # 超出时间预算的部分结果不写入缓存
+                if control.truncated:
+                    record['truncated'] = True
+                    cache_file = None
+            if cache_file:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                write_cache_file(cache_file, {
+                    'status': 'success',
+                    'markdown_path': os.path.abspath(output_path)
+                })
+            record['status'] = 'success'
+    except Exception as e:
+        logger.error(f"Error processing file {source}: {e}")
+        record['status'] = 'failure'
+        record['error'] = str(e)
+
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+def init_worker(log_level: int):
+    """子进程初始化：模型由 converter 在首次使用时懒加载"""
+    load_dotenv()
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+def run(input_dir: Path, output_dir: Path, workers: int, cache_dir: Path | None,
+        manifest_path: Path, summary_path: Path, debug_dir: Path | None,
+        log_level: int = logging.WARNING) -> dict:
+    """转换 input_dir 下的所有文件，返回汇总信息"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if cache_dir:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+    done = {
+        source for source, record in load_manifest(manifest_path).items()
+        if record.get('status') in ('success', 'cached') and os.path.exists(record['output'])
+    }
+    logger.info(f"Resuming with {len(done)} files already converted")
+
+    counts = {'success': 0, 'cached': 0, 'failure': 0, 'skipped': 0}
+    timings = []
+    started = time.perf_counter()
+
+    def tasks():
+        for source in iter_source_files(input_dir, exclude=output_dir):
+            relative = source.relative_to(input_dir).as_posix()
+            if relative in done:
+                counts['skipped'] += 1
+                continue
+            # 保留源文件扩展名（a.pdf -> a.pdf.md），同目录下的 a.pdf 和 a.docx 不会互相覆盖
+            output_path = output_dir / f"{relative}.md"
+            yield str(source), relative, str(output_path)
+
+    def make_executor():
+        return ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(log_level,))
+
+    with open(manifest_path, 'a', encoding='utf-8') as manifest:
+        executor = make_executor()
+        # future -> (相对路径, 输出路径)，子进程崩溃时用于记录失败
+        pending = {}
+        # 限制在途任务数量，避免几十万个文件一次性提交占满内存
+        max_pending = workers * 4
+
+        def collect(finished) -> bool:
+            """写入已完成任务的清单记录，返回进程池是否已损坏"""
+            broken = False
+            for future in finished:
+                relative, output_path = pending.pop(future)
+                try:
+                    record = future.result()
+                except BrokenProcessPool as e:
+                    # 子进程被杀死（OOM、原生库崩溃）时池内所有在途任务都会失败
+                    broken = True
+                    record = {
+                        'source': relative,
+                        'output': output_path,
+                        'status': 'failure',
+                        'error': f"Worker process crashed: {e}",
+                        'seconds': 0
+                    }
+                counts[record['status']] += 1
+                timings.append({
+                    'source': record['source'],
+                    'status': record['status'],
+                    'seconds': record['seconds']
+                })
+                manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+                manifest.flush()
+                logger.info(f"[{record['status']}] {record['source']} ({record['seconds']}s)")
+            return broken
+
+        def drain(return_when):
+            nonlocal executor
+            finished, _ = wait(set(pending), return_when=return_when)
+            if collect(finished):
+                # 剩余的在途任务也已失败，全部记录后重建进程池继续
+                finished, _ = wait(set(pending))
+                collect(finished)
+                logger.warning("Worker process crashed, restarting the process pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = make_executor()
+
+        try:
+            for source, relative, output_path in tasks():
+                if len(pending) >= max_pending:
+                    drain(FIRST_COMPLETED)
+                future = executor.submit(
+                    convert_one, source, relative, output_path,
+                    str(cache_dir) if cache_dir else None,
+                    str(debug_dir) if debug_dir else None
+                )
+                pending[future] = (relative, output_path)
+
+            while pending:
+                drain(ALL_COMPLETED)
+        finally:
+            executor.shutdown()
+
+    durations = [item['seconds'] for item in timings]
+    summary = {
+        'input_dir': str(input_dir),
+        'output_dir': str(output_dir),
+        'workers': workers,
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+        'counts': counts,
+        'total_convert_seconds': round(sum(durations), 3),
+        'max_convert_seconds': max(durations, default=0),
+        'files': timings
+    }
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a directory tree of documents to Markdown")
+    parser.add_argument('input_dir', type=Path, help="Directory containing source documents")
+    parser.add_argument('output_dir', type=Path, help="Directory to write Markdown files to")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--cache-dir', type=Path, default=Path(os.getcwd()) / 'cache',
+                        help="Content-addressed cache directory shared with the web service")
+    parser.add_argument('--no-cache', action='store_true', help="Disable the conversion cache")
+    parser.add_argument('--manifest', type=Path, help="Resume manifest (default: OUTPUT_DIR/manifest.jsonl)")
+    parser.add_argument('--summary', type=Path, help="Timing summary (default: OUTPUT_DIR/summary.json)")
+    parser.add_argument('--debug-dir', type=Path, help="Save OCR debug pages to this directory")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log every file")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(
+        level=log_level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    summary = run(
+        input_dir=args.input_dir,
+        output_dir=args.output_dir,
+        workers=max(1, args.workers),
+        cache_dir=None if args.no_cache else args.cache_dir,
+        manifest_path=args.manifest or args.output_dir / 'manifest.jsonl',
+        summary_path=args.summary or args.output_dir / 'summary.json',
+        debug_dir=args.debug_dir,
+        log_level=log_level
+    )
+    print(json.dumps(summary['counts']))
+    return 1 if summary['counts']['failure'] else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
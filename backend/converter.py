@@ -0,0 +1,666 @@
+"""文档转换流水线，不依赖 Flask/Celery/Redis，可被 Web 任务和命令行批量转换共用"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from typing import Callable
+
+import cv2
+import httpx
+import numpy as np
+import pytesseract
+from markitdown import MarkItDown
+from openai import OpenAI
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+logger = logging.getLogger(__name__)
+
+# Supported file extensions (根据 MarkItDown 文档)
+SUPPORTED_EXTENSIONS = (
+    # Documents
+    '.pdf', '.pptx', '.docx', '.xlsx',
+    # Images
+    '.jpg', '.jpeg', '.png',
+    # Audio
+    '.mp3', '.wav',
+    # Text-based formats
+    '.html', '.csv', '.json', '.xml',
+    # Archives
+    '.zip'
+)
+
+# 页码范围的上限，避免 "1-1000000000" 之类的输入展开成巨大的列表
+MAX_PAGE_NUMBER = 10000
+
+# 时间预算（秒），0 表示不限制；整篇文档预算默认关闭，超出时结果会被截断
+DOCUMENT_BUDGET = float(os.getenv('CONVERT_DOCUMENT_BUDGET_SECONDS', '0'))
+STAGE_BUDGETS = {
+    'tesseract': float(os.getenv('CONVERT_TESSERACT_BUDGET_SECONDS', '60')),
+    'paddle': float(os.getenv('CONVERT_PADDLE_BUDGET_SECONDS', '60')),
+    'llm': float(os.getenv('CONVERT_LLM_BUDGET_SECONDS', '120')),
+}
+LLM_REQUEST_TIMEOUT = 60.0
+LLM_MAX_RETRIES = 3
+
+class ConversionCancelled(Exception):
+    """任务已被取消"""
+
+class ConversionTimeout(Exception):
+    """超出整篇文档的时间预算"""
+
+class ConversionControl:
+    """协作式取消与时间预算，在页与页之间、各识别引擎调用之间检查
+
+    某个引擎单次耗时超出阶段预算后，本文档后续页面直接跳过该引擎。
+    超出文档预算而只返回部分页面时 truncated 为 True，调用方不应把该结果当作缓存命中。
+    """
+
+    def __init__(self, is_cancelled: Callable[[], bool] | None = None,
+                 document_budget: float = DOCUMENT_BUDGET, stage_budgets: dict | None = None):
+        self.is_cancelled = is_cancelled
+        self.deadline = time.monotonic() + document_budget if document_budget else None
+        self.stage_budgets = {**STAGE_BUDGETS, **(stage_budgets or {})}
+        self.skipped_stages = set()
+        self.truncated = False
+
+    def check_cancelled(self):
+        if self.is_cancelled and self.is_cancelled():
+            raise ConversionCancelled("Conversion cancelled")
+
+    def check(self):
+        """取消或超出文档预算时抛出异常"""
+        self.check_cancelled()
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise ConversionTimeout("Document time budget exceeded")
+
+    def budget(self, stage: str) -> float | None:
+        """本阶段可用的秒数：阶段预算与文档剩余预算取较小值，None 表示不限制"""
+        budgets = []
+        if self.stage_budgets.get(stage):
+            budgets.append(self.stage_budgets[stage])
+        if self.deadline is not None:
+            budgets.append(max(self.deadline - time.monotonic(), 0))
+        return min(budgets) if budgets else None
+
+    def should_run(self, stage: str) -> bool:
+        if stage in self.skipped_stages:
+            return False
+        budget = self.budget(stage)
+        return budget is None or budget > 0
+
+    def record(self, stage: str, elapsed: float):
+        """记录引擎耗时，超出阶段预算则后续页面跳过该引擎"""
+        budget = self.stage_budgets.get(stage)
+        if budget and elapsed > budget:
+            logger.warning(f"{stage} took {elapsed:.1f}s (budget {budget:.0f}s), skipping it for remaining pages")
+            self.skipped_stages.add(stage)
+
+# 模型和客户端按进程懒加载，进程池中的每个子进程各自初始化一次
+_client = None
+_md = None
+_paddle_ocr = None
+
+def get_llm_client() -> OpenAI | None:
+    """获取 OpenAI 客户端，未配置 API Key 时返回 None"""
+    global _client
+    if _client is None and os.getenv('OPENAI_API_KEY'):
+        base_url = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+        logger.info(f"Initializing OpenAI client with base_url: {base_url}")
+        _client = OpenAI(
+            base_url=base_url,
+            api_key=os.getenv('OPENAI_API_KEY'),
+
+            timeout=httpx.Timeout(60.0),  # 置较长的超时时间
+            max_retries=3,  # 添加重试次数
+        )
+    return _client
+
+def get_markitdown() -> MarkItDown:
+    """获取 MarkItDown 实例"""
+    global _md
+    if _md is None:
+        _md = MarkItDown(
+            llm_client=get_llm_client(),
+            llm_model=os.getenv('OPENAI_LLM_MODEL', 'text-davinci-003'),
+        )
+    return _md
+
+def get_paddle_ocr():
+    """获取 PaddleOCR 实例"""
+    global _paddle_ocr
+    if _paddle_ocr is None:
+        from paddleocr import PaddleOCR
+        _paddle_ocr = PaddleOCR(use_angle_cls=True, lang='ch', use_gpu=False)
+        logger.info("PaddleOCR initialized successfully")
+    return _paddle_ocr
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in [ext.lstrip('.') for ext in SUPPORTED_EXTENSIONS]
+
+def calculate_file_hash(file_path: str) -> str:
+    """计算文件的SHA256哈希值"""
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for byte_block in iter(lambda: f.read(4096), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+def read_cache_file(cache_file: str) -> dict | None:
+    """读取缓存文件，markdown 文件已不存在或结果被截断时视为未命中"""
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache_data = json.load(f)
+            # 验证缓存的文件是否存在
+            if os.path.exists(cache_data['markdown_path']) and not cache_data.get('truncated'):
+                return cache_data
+        except Exception as e:
+            logger.error(f"Error reading cache: {e}")
+    return None
+
+def write_cache_file(cache_file: str, result: dict):
+    """写入缓存文件"""
+    try:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+    except Exception as e:
+        logger.error(f"Error saving cache: {e}")
+
+def is_valid_content(content: str) -> bool:
+    """验证提取的内容是否有效"""
+    # 移除空白字符后的最小有效长度
+    MIN_CONTENT_LENGTH = 50
+
+    if not content or len(content.strip()) < MIN_CONTENT_LENGTH:
+        return False
+
+    # Anna's Archive 元数据特征识别
+    anna_archive_indicators = [
+        "Document generated by Anna",
+        "Anna's Archive",
+        "DuXiu collection",
+        "annas-blog.org",
+        "pdg_dir_name",
+        "pdg_main_pages",
+        "pdf_generation_missing_pages",
+        '"filename_decoded"',
+        '"total_pixels"',
+        '"zip_password"'
+    ]
+
+    # 检查是否包含典型的JSON字段组合
+    json_field_combinations = [
+        ('filesize', 'md5', 'sha1'),
+        ('crc32', 'uncompressed_size'),
+        ('header_md5', 'sha256')
+    ]
+
+    # 计算 Anna's Archive 指标出现次数
+    anna_indicators_count = sum(1 for indicator in anna_archive_indicators if indicator in content)
+
+    # 检查 JSON 字段组合
+    json_combinations_present = any(
+        all(field in content for field in combination)
+        for combination in json_field_combinations
+    )
+
+    # 如果包含多个 Anna's Archive 特征或特定的 JSON 字段组合，认为是元数据
+    if anna_indicators_count >= 2 or json_combinations_present:
+        logger.info(f"Detected Anna's Archive metadata: {anna_indicators_count} indicators, JSON fields: {json_combinations_present}")
+        return False
+
+    # 判断是否是广告或垃圾信息
+    spam_keywords = [
+        "开户客服微信",
+        "扫描二维码",
+        "手续费",
+        "股票期货",
+        "无门槛",
+        "加微信",
+        "国企证券",
+        "万一",
+        "开股票账户",
+        "开期货账户",
+        '账户',
+        "加一分",
+        "国企期货",
+        '期货',
+        "书籍下载",
+        "点击网站链接",
+        "二维码添加微信",
+    ]
+
+    # 计算垃圾关键词出现的次数
+    spam_count = sum(1 for keyword in spam_keywords if keyword in content)
+    # 如果出现超过2个关键词，认为是垃圾信息
+    if (spam_count > 1):
+        return False
+
+    # 检查是否包含足够的中文字符
+    chinese_chars = len([c for c in content if '\u4e00' <= c <= '\u9fff'])
+    if chinese_chars > 0:
+        # 如果包含中文，要求中文字符至少占10%
+        if chinese_chars / len(content.strip()) < 0.1:
+            return False
+
+    return True
+
+def enhance_image_quality(image_path):
+    """增强图片质量"""
+    # 读取图片
+    img = cv2.imread(image_path)
+    if img is None:
+        return False
+
+    try:
+        # 转换为灰度图
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        # 自适应阈值二值化
+        binary = cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY, 11, 2
+        )
+
+        # 降噪
+        denoised = cv2.fastNlMeansDenoising(binary)
+
+        # 提高对比度
+        enhanced = cv2.convertScaleAbs(denoised, alpha=1.2, beta=0)
+
+        # 锐化
+        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+        sharpened = cv2.filter2D(enhanced, -1, kernel)
+
+        # 调整亮度和对比度
+        bright = cv2.convertScaleAbs(sharpened, alpha=1.1, beta=10)
+
+        # 保存增强后的图片
+        enhanced_path = image_path.replace('.png', '_enhanced.png')
+        cv2.imwrite(enhanced_path, bright)
+
+        return enhanced_path
+    except Exception as e:
+        logger.error(f"Image enhancement failed: {e}")
+        return False
+
+def parse_page_range(spec: str, max_page: int | None = None) -> list[int]:
+    """解析页码范围，如 "1-3,5" -> [1, 2, 3, 5]，页码从1开始
+
+    超出 max_page（默认 MAX_PAGE_NUMBER）的页码被忽略，全部超出时视为无效。
+    """
+    max_page = min(max_page or MAX_PAGE_NUMBER, MAX_PAGE_NUMBER)
+    pages = set()
+    valid = False
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        start, sep, end = part.partition('-')
+        if not start.isdigit() or (sep and not end.isdigit()):
+            raise ValueError(f"Invalid page range: {spec}")
+        first, last = int(start), int(end or start)
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid page range: {spec}")
+        valid = True
+        pages.update(range(first, min(last, max_page) + 1))
+    if not pages:
+        raise ValueError(f"Invalid page range: {spec}" if not valid
+                         else f"Page range exceeds the maximum of {max_page} pages: {spec}")
+    return sorted(pages)
+
+def format_page(page_number: int, page_text: str) -> str:
+    """单页结果的Markdown片段"""
+    return f"## Page {page_number}\n\n{page_text}\n\n"
+
+def extract_pdf_pages(filepath: str, pages: list[int], output_path: str):
+    """将PDF中指定的页另存为新的PDF"""
+    import fitz
+    with fitz.open(filepath) as src, fitz.open() as dst:
+        for page_number in pages:
+            if page_number <= src.page_count:
+                dst.insert_pdf(src, from_page=page_number - 1, to_page=page_number - 1)
+        dst.save(output_path)
+
+def process_image_with_paddle_ocr(image_path):
+    """使用PaddleOCR处理图片"""
+    try:
+        logger.info(f"Processing image with PaddleOCR: {image_path}")
+        result = get_paddle_ocr().ocr(image_path, cls=True)
+
+        if not result or not result[0]:
+            logger.warning("PaddleOCR returned empty result")
+            return ""
+
+        # 提取识别的文本
+        text_content = []
+        for line in result[0]:
+            if len(line) >= 2:  # 确保结果包含文本部分
+                text_content.append(line[1][0])  # 获取识别的文本内容
+
+        return "\n".join(text_content)
+    except Exception as e:
+        logger.error(f"PaddleOCR processing failed: {e}")
+        return ""
+
+def process_image_with_llm(image_path: str, debug_subdir: str | None, page_number: int,
+                           budget: float | None = None) -> str:
+    """使用视觉大模型识别图片，budget 限制包括重试在内的总耗时"""
+    client = get_llm_client()
+    if client is None:
+        raise Exception("OPENAI_API_KEY environment variable is not set")
+
+    if budget is not None:
+        timeout = min(LLM_REQUEST_TIMEOUT, budget)
+        max_retries = max(0, min(LLM_MAX_RETRIES, int(budget // timeout) - 1))
+        client = client.with_options(timeout=timeout, max_retries=max_retries)
+
+    logger.info(f"Making API request to: {client.base_url}/chat/completions")
+    with open(image_path, 'rb') as img_file:
+        # 记录图片大小
+        img_file.seek(0, 2)
+        file_size = img_file.tell()
+        img_file.seek(0)
+        logger.info(f"Processing image size: {file_size/1024/1024:.2f}MB")
+
+        response = client.chat.completions.create(
+            model=os.getenv('OPENAI_LLM_MODEL', 'gpt-4-vision-preview'),
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "请识别这个图片中的所有文字内容。如果发现表格，请转换为Markdown表格格式。请保持原始的段落结构和格式。"
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/png;base64,{base64.b64encode(img_file.read()).decode('utf-8')}"
+                            }
+                        }
+                    ]
+                }
+            ],
+        )
+
+    # 处理返回的文本
+    page_text = response.choices[0].message.content or ''
+    logger.info(f"OCR Result Preview: {page_text[:200]}...")  # 打印前200个字符
+    logger.info(f"OCR Result Length: {len(page_text)}")
+
+    if not page_text.strip():
+        logger.warning(f"Empty OCR result for page {page_number}")
+        # 保存失败的请求信息
+        if debug_subdir:
+            with open(os.path.join(debug_subdir, f'failed_request_page_{page_number}.txt'), 'w') as f:
+                f.write(f"Response: {response}\n")
+                f.write(f"Content: {page_text}")
+
+    return page_text
+
+def ocr_page(image_path: str, page_number: int, debug_subdir: str | None = None,
+             control: ConversionControl | None = None) -> str:
+    """对单页图片依次尝试 Tesseract、PaddleOCR 和视觉大模型，返回识别出的文本"""
+    control = control or ConversionControl()
+    logger.info("Starting multi-stage OCR process...")
+
+    # 1. 首先尝试Tesseract
+    tesseract_text = ''
+    control.check_cancelled()
+    if control.should_run('tesseract'):
+        logger.info("1. Attempting Tesseract OCR...")
+        started = time.monotonic()
+        try:
+            tesseract_text = pytesseract.image_to_string(
+                image_path, lang='chi_sim+eng', timeout=control.budget('tesseract') or 0
+            )
+        except RuntimeError as e:
+            # pytesseract 超时会终止进程并抛出 RuntimeError
+            logger.warning(f"Tesseract OCR timed out on page {page_number}: {e}")
+        control.record('tesseract', time.monotonic() - started)
+
+    # 2. 尝试PaddleOCR
+    paddle_text = ''
+    control.check_cancelled()
+    if not is_valid_content(tesseract_text) and control.should_run('paddle'):
+        logger.info("2. Attempting PaddleOCR...")
+        started = time.monotonic()
+        paddle_text = process_image_with_paddle_ocr(image_path)
+        control.record('paddle', time.monotonic() - started)
+
+    # 3. 选择最佳结果
+    if is_valid_content(tesseract_text):
+        logger.info("Using Tesseract OCR result")
+        page_text = tesseract_text
+    elif is_valid_content(paddle_text):
+        logger.info("Using PaddleOCR result")
+        page_text = paddle_text
+    else:
+        # 4. 如果两者都不理想，使用GPT-4V
+        logger.info("Local OCR results not satisfactory, trying GPT-4V...")
+        control.check_cancelled()
+        try:
+            if not control.should_run('llm'):
+                raise Exception("LLM stage skipped: time budget exhausted")
+            started = time.monotonic()
+            try:
+                page_text = process_image_with_llm(image_path, debug_subdir, page_number, control.budget('llm'))
+            finally:
+                control.record('llm', time.monotonic() - started)
+        except Exception as gpt_error:
+            logger.error(f"GPT-4V processing error: {gpt_error}")
+            # 如果GPT-4V失败，使用Tesseract的结果
+            page_text = tesseract_text or paddle_text or "OCR处理失败"
+
+    # 保存调试信息
+    if page_text.strip() and debug_subdir:
+        debug_info = {
+            'tesseract_result': tesseract_text,
+            'paddle_result': paddle_text,
+            'final_result': page_text
+        }
+        with open(os.path.join(debug_subdir, f'ocr_debug_page_{page_number}.json'), 'w', encoding='utf-8') as f:
+            json.dump(debug_info, f, ensure_ascii=False, indent=2)
+
+    return page_text
+
+def convert_pdf_with_ocr(filepath: str, debug_folder: str | None = None,
+                         progress_callback: Callable[[float], None] | None = None,
+                         pages: list[int] | None = None,
+                         page_callback: Callable[[int, str, int], None] | None = None,
+                         control: ConversionControl | None = None) -> str:
+    """将PDF逐页转为图片并进行OCR
+
+    pages 限定要处理的页码；每页完成后调用 page_callback(页码, 文本, 总页数)。
+    超出文档时间预算时停止处理剩余页面，返回已识别的内容。
+    """
+    control = control or ConversionControl()
+    logger.info("Converting PDF to images for OCR processing...")
+    content = ''
+
+    debug_subdir = None
+    if debug_folder:
+        # 创建调试目录
+        debug_subdir = os.path.join(debug_folder, os.path.splitext(os.path.basename(filepath))[0])
+        os.makedirs(debug_subdir, exist_ok=True)
+        logger.info(f"Debug images will be saved to: {debug_subdir}")
+
+    page_count = pdfinfo_from_path(filepath)['Pages']
+    page_numbers = [p for p in pages if p <= page_count] if pages else list(range(1, page_count + 1))
+    total_images = len(page_numbers)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for index, page_number in enumerate(page_numbers):
+            try:
+                control.check()
+            except ConversionTimeout:
+                if not content.strip():
+                    raise
+                logger.warning(f"Document time budget exceeded, stopping before page {page_number}")
+                control.truncated = True
+                content += f"> 转换超出时间预算，第 {page_number} 页及之后的页面未处理\n\n"
+                break
+
+            i = page_number - 1
+            logger.info(f"Processing page {page_number} ({index+1}/{total_images})")
+            if progress_callback:
+                progress_callback(10 + (80 * index / total_images))
+
+            # 逐页转换为图像，不必一次性把整本文档渲染到内存
+            image = convert_from_path(filepath, first_page=page_number, last_page=page_number)[0]
+
+            # 保存图像到临时文件和调试目录
+            temp_image = os.path.join(temp_dir, f'page_{i}.png')
+            image.save(temp_image, 'PNG')
+            if debug_subdir:
+                debug_image = os.path.join(debug_subdir, f'page_{i}.png')
+                image.save(debug_image, 'PNG')
+                logger.info(f"Saved debug image: {debug_image}")
+
+            # 增强图片质量
+            enhanced_image = enhance_image_quality(temp_image)
+            if enhanced_image:
+                logger.info(f"Successfully enhanced image quality")
+                if debug_subdir:
+                    shutil.copy2(enhanced_image, os.path.join(debug_subdir, f'page_{i}_enhanced.png'))
+                # 使用增强后的图片进行OCR
+                temp_image = enhanced_image
+
+            try:
+                page_text = ocr_page(temp_image, page_number, debug_subdir, control)
+            except ConversionCancelled:
+                raise
+            except Exception as ocr_error:
+                logger.error(f"OCR processing error on page {page_number}: {ocr_error}")
+                if debug_subdir:
+                    with open(os.path.join(debug_subdir, f'error_log_page_{page_number}.txt'), 'w') as f:
+                        f.write(f"Error: {str(ocr_error)}\n")
+                page_text = ''
+
+            # 保存识别结果
+            if page_text.strip():
+                content += format_page(page_number, page_text)
+            else:
+                logger.warning(f"Empty OCR result for page {page_number}")
+
+            if page_callback:
+                page_callback(page_number, page_text, total_images)
+
+    # 检查最终结果
+    if content.strip():
+        logger.info(f"Total extracted content length: {len(content)}")
+        logger.info("Content preview:")
+        logger.info(content[:500])  # 打印前500个字符
+    else:
+        logger.error("No content extracted from OCR")
+        raise Exception("No content extracted from PDF via OCR")
+
+    # 保存完整的OCR结果用于调试
+    if debug_subdir:
+        with open(os.path.join(debug_subdir, 'full_ocr_result.txt'), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+    return content
+
+def extract_zip_text(filepath: str) -> str:
+    """直接从ZIP包中提取文本文件内容"""
+    logger.info("Detected metadata in ZIP result, trying direct extraction...")
+    with zipfile.ZipFile(filepath, 'r') as zip_ref:
+        # 获取所有文本文件
+        text_files = [f for f in zip_ref.namelist() if f.endswith('.txt')]
+        content = ''
+        for txt_file in text_files:
+            with zip_ref.open(txt_file) as f:
+                content += f.read().decode('utf-8', errors='ignore') + '\n\n'
+
+        if not content.strip():
+            # 如果没有找到文本文件，尝试其他类型的文件
+            for f in zip_ref.namelist():
+                if not f.endswith(('.jpg', '.png', '.gif')):  # 跳过图片文件
+                    try:
+                        with zip_ref.open(f) as file:
+                            content += f'# {f}\n\n'
+                            content += file.read().decode('utf-8', errors='ignore') + '\n\n'
+                    except:
+                        continue
+    logger.info("Successfully extracted ZIP content")
+    return content
+
+def convert_document(filepath: str, debug_folder: str | None = None,
+                     progress_callback: Callable[[float], None] | None = None,
+                     pages: list[int] | None = None,
+                     page_callback: Callable[[int, str, int], None] | None = None,
+                     control: ConversionControl | None = None) -> str:
+    """将文档转换为Markdown文本
+
+    先用 MarkItDown 解析，内容无效时 PDF 走逐页 OCR、ZIP 直接提取文本。
+    progress_callback 接收 0-100 的进度值；pages 仅转换PDF的指定页，
+    OCR 时每完成一页调用 page_callback(页码, 文本, 总页数)。
+    control 用于取消和时间预算，取消时抛出 ConversionCancelled。
+    """
+    control = control or ConversionControl()
+    logger.info(f"Starting conversion for file: {filepath}")
+
+    # 检查文件是否存在
+    if not os.path.exists(filepath):
+        logger.error(f"File not found: {filepath}")
+        raise Exception("File not found")
+
+    file_extension = os.path.splitext(filepath)[1].lower()
+    if pages and file_extension != '.pdf':
+        raise Exception("Page ranges are only supported for PDF files")
+
+    if progress_callback:
+        progress_callback(10)
+
+    # 先尝试使用 MarkItDown 转换
+    control.check()
+    logger.info("Attempting conversion with MarkItDown...")
+    if pages:
+        # 只解析指定页，避免整本大文档都交给 MarkItDown
+        with tempfile.TemporaryDirectory() as temp_dir:
+            subset_path = os.path.join(temp_dir, os.path.basename(filepath))
+            extract_pdf_pages(filepath, pages, subset_path)
+            result = get_markitdown().convert(subset_path)
+    else:
+        result = get_markitdown().convert(filepath)
+    content = result.text_content
+    logger.debug(f"Initial conversion result: {content[:200]}...")
+    logger.info(f"Content starts with: {content[:50]}")  # 添加调试日志
+
+    # 验证 MarkItDown 转换的内容
+    valid_content = is_valid_content(content)
+    logger.info(f"Content validation result: {valid_content}")  # 添加调试日志
+
+    if not valid_content:
+        logger.warning("MarkItDown content validation failed, trying OCR...")
+
+        if file_extension == '.pdf':
+            control.check()
+            try:
+                content = convert_pdf_with_ocr(filepath, debug_folder, progress_callback, pages, page_callback, control)
+            except (ConversionCancelled, ConversionTimeout):
+                raise
+            except Exception as e:
+                logger.error(f"Error in PDF processing: {str(e)}", exc_info=True)
+                raise Exception(f"PDF processing failed: {str(e)}")
+
+        elif file_extension == '.zip':
+            try:
+                content = extract_zip_text(filepath)
+            except Exception as e:
+                logger.error(f"Error extracting ZIP content: {e}")
+                # 如果提取失败，保留原始内容
+                content = result.text_content
+
+    # 最终检查内容
+    if not content or len(content.strip()) == 0:
+        logger.error("No content extracted from file")
+        raise Exception("Failed to extract content from file")
+
+    return content
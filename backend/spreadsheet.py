@@ -0,0 +1,218 @@
+"""XLSX/CSV 流式转换：逐行读取并分块写出 Markdown 表格，内存占用与行数无关"""
+import csv
+import io
+import logging
+import os
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+SPREADSHEET_EXTENSIONS = ('.xlsx', '.csv')
+
+# 每隔多少行上报一次进度，避免频繁写结果后端
+PROGRESS_EVERY_ROWS = 5000
+# 写文件前累积的行数
+WRITE_CHUNK_ROWS = 1000
+
+def format_cell(value) -> str:
+    """单元格转为 Markdown 表格文本，转义竖线并去掉换行"""
+    if value is None:
+        return ''
+    text = str(value)
+    return text.replace('\\', '\\\\').replace('|', '\\|').replace('\r\n', '<br>').replace('\n', '<br>').strip()
+
+def format_row(cells: list[str]) -> str:
+    return '| ' + ' | '.join(cells) + ' |\n'
+
+class MarkdownTableWriter:
+    """把行写入一个或多个 Markdown 文件，按工作表或行数切分"""
+
+    def __init__(self, output_path: str, split_sheets: bool = False, rows_per_file: int = 0):
+        self.output_path = output_path
+        self.split_sheets = split_sheets
+        self.rows_per_file = rows_per_file
+        self.paths = []
+        self._file = None
+        self._buffer = []
+        self._sheet = None
+        self._header = None
+        self._rows_in_file = 0
+
+    def _part_path(self) -> str:
+        if not self.split_sheets and not self.rows_per_file:
+            return self.output_path
+        stem, ext = os.path.splitext(self.output_path)
+        return f"{stem}_part{len(self.paths) + 1}{ext}"
+
+    def _open_part(self):
+        self._close_part()
+        path = self._part_path()
+        self._file = open(path, 'w', encoding='utf-8')
+        self.paths.append(path)
+        self._rows_in_file = 0
+
+    def _close_part(self):
+        if self._file:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def _write_table_header(self):
+        self._buffer.append(f"## {self._sheet}\n\n" if self._sheet else '')
+        self._buffer.append(format_row(self._header))
+        self._buffer.append(format_row(['---'] * len(self._header)))
+
+    def start_sheet(self, name: str | None, header: list[str]):
+        """开始一个新表格，header 为第一行"""
+        self._sheet = name
+        self._header = header or ['']
+        if (self._file is None or self.split_sheets
+                or (self.rows_per_file and self._rows_in_file >= self.rows_per_file)):
+            # 当前分片已满时新表格直接从下一个分片开始，不在末尾留下只有表头的表格
+            self._open_part()
+        else:
+            self._buffer.append('\n')
+        self._write_table_header()
+
+    def write_row(self, cells: list[str]):
+        if self.rows_per_file and self._rows_in_file >= self.rows_per_file:
+            # 新文件重复表头，保证每个分片都是完整的表格
+            self._open_part()
+            self._write_table_header()
+
+        width = len(self._header)
+        if len(cells) < width:
+            cells = cells + [''] * (width - len(cells))
+        elif len(cells) > width:
+            # 表头已经写出，超出表头宽度的单元格合并到最后一列，避免渲染时被丢弃
+            while len(cells) > width and not cells[-1]:
+                cells.pop()
+            if len(cells) > width:
+                cells = cells[:width - 1] + [' \\| '.join(cells[width - 1:])]
+        self._buffer.append(format_row(cells))
+        self._rows_in_file += 1
+        if len(self._buffer) >= WRITE_CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self._file and self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer.clear()
+
+    def close(self):
+        self._close_part()
+
+def iter_xlsx_sheets(filepath: str):
+    """以只读模式逐行读取 XLSX，返回 (工作表名, 行迭代器, 进度函数)"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        total_sheets = len(workbook.worksheets)
+        for index, sheet in enumerate(workbook.worksheets):
+            max_row = sheet.max_row or 0
+            # 只读模式下行数来自工作表的 dimension 记录，可能缺失
+            progress = lambda rows, index=index, max_row=max_row: (
+                (index + (min(rows / max_row, 1) if max_row else 0)) / total_sheets
+            )
+            yield sheet.title, sheet.iter_rows(values_only=True), progress
+    finally:
+        workbook.close()
+
+def detect_encoding(sample: bytes) -> str:
+    """根据文件开头推断 CSV 编码，Excel 导出的中文 CSV 常为 GBK/GB18030"""
+    # 只用完整的行，避免截断的多字节字符影响判断
+    sample = sample.rsplit(b'\n', 1)[0] if b'\n' in sample else sample
+    try:
+        sample.decode('utf-8')
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        pass
+
+    from charset_normalizer import from_bytes
+
+    best = from_bytes(sample).best()
+    # 无法判断时按 GB18030 处理，它兼容 GBK 和 GB2312
+    return best.encoding if best else 'gb18030'
+
+def iter_csv_sheets(filepath: str):
+    """逐行读取 CSV，作为单个无名工作表，按已读取的字节数估算进度"""
+    file_size = os.path.getsize(filepath) or 1
+    with open(filepath, 'rb') as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        encoding = detect_encoding(sample)
+        logger.info(f"Reading {os.path.basename(filepath)} as {encoding}")
+
+        # 只用完整的行推断分隔符
+        text_sample = sample.decode(encoding, errors='replace').rsplit('\n', 1)[0]
+        try:
+            dialect = csv.Sniffer().sniff(text_sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+
+        lines = io.TextIOWrapper(f, encoding=encoding, errors='replace', newline='')
+        try:
+            yield None, csv.reader(lines, dialect), lambda rows: f.tell() / file_size
+        finally:
+            # 不让包装器关闭外层 with 管理的文件
+            lines.detach()
+
+def convert_spreadsheet(filepath: str, output_path: str,
+                        progress_callback: Callable[[float, int], None] | None = None,
+                        split_sheets: bool = False, rows_per_file: int = 0) -> list[str]:
+    """将 XLSX/CSV 流式转换为 Markdown 表格，返回写出的文件路径
+
+    split_sheets 为每个工作表单独输出一个文件，rows_per_file 每 N 行切分一个文件。
+    progress_callback 接收 (0-100 的进度, 已处理行数)。
+    """
+    file_extension = os.path.splitext(filepath)[1].lower()
+    if file_extension == '.xlsx':
+        sheets = iter_xlsx_sheets(filepath)
+    elif file_extension == '.csv':
+        sheets = iter_csv_sheets(filepath)
+    else:
+        raise Exception(f"Unsupported spreadsheet type: {file_extension}")
+
+    writer = MarkdownTableWriter(output_path, split_sheets, rows_per_file)
+    total_rows = 0
+    scanned_rows = 0
+    try:
+        for name, rows, sheet_progress in sheets:
+            logger.info(f"Streaming sheet {name or os.path.basename(filepath)}")
+            sheet_rows = 0
+            sheet_scanned = 0
+            for row in rows:
+                sheet_scanned += 1
+                scanned_rows += 1
+                # 按已扫描的行数上报，跳过大量空行时也能更新进度和检查取消
+                if progress_callback and scanned_rows % PROGRESS_EVERY_ROWS == 0:
+                    progress_callback(10 + 80 * min(sheet_progress(sheet_scanned), 1), total_rows)
+
+                cells = [format_cell(value) for value in row]
+                # 只读模式下带格式的空白区域也会逐行返回，空行不写出
+                if not any(cells):
+                    continue
+                if sheet_rows == 0:
+                    writer.start_sheet(name, cells)
+                else:
+                    writer.write_row(cells)
+                sheet_rows += 1
+                total_rows += 1
+    except BaseException:
+        # 失败或被取消时不留下不完整的输出
+        writer.close()
+        for path in writer.paths:
+            os.remove(path)
+        raise
+    writer.close()
+
+    if total_rows == 0:
+        for path in writer.paths:
+            os.remove(path)
+        raise Exception("Failed to extract content from file")
+
+    if progress_callback:
+        progress_callback(90, total_rows)
+    logger.info(f"Wrote {total_rows} rows to {len(writer.paths)} markdown file(s)")
+    return writer.paths
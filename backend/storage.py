@@ -0,0 +1,319 @@
+"""存储布局与生命周期管理：哈希分片目录、配额、过期清理和回收统计
+
+不依赖 Flask/Celery，Web 服务、Celery 定时任务和命令行工具共用。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+HOUR = 3600
+DAY = 24 * HOUR
+
+# 配额，0 表示不限制
+DEVICE_QUOTA_BYTES = int(os.getenv('STORAGE_DEVICE_QUOTA_MB', '2048')) * MB
+GLOBAL_QUOTA_BYTES = int(os.getenv('STORAGE_GLOBAL_QUOTA_MB', '0')) * MB
+
+# 过期时间
+UPLOAD_TTL = float(os.getenv('STORAGE_UPLOAD_TTL_HOURS', '24')) * HOUR
+MARKDOWN_TTL = float(os.getenv('STORAGE_MARKDOWN_TTL_DAYS', '30')) * DAY
+DEBUG_TTL = float(os.getenv('STORAGE_DEBUG_TTL_HOURS', '72')) * HOUR
+BATCH_TTL = float(os.getenv('STORAGE_BATCH_TTL_DAYS', '7')) * DAY
+# 转换中的任务先写 markdown 再写缓存，留出宽限期避免误删
+ORPHAN_GRACE = float(os.getenv('STORAGE_ORPHAN_GRACE_HOURS', '1')) * HOUR
+
+SWEEP_CATEGORIES = ('upload', 'markdown', 'orphan_markdown', 'cache', 'debug', 'batch', 'quota')
+
+class QuotaExceeded(Exception):
+    """写入会超出存储配额"""
+
+def shard_parts(key: str) -> tuple[str, str]:
+    """根据键的哈希得到两级分片目录名"""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return digest[:2], digest[2:4]
+
+def sharded_path(root: str, key: str, suffix: str = '') -> str:
+    """返回 root/ab/cd/<key><suffix>，避免单个目录下文件过多"""
+    return os.path.join(root, *shard_parts(key), f"{key}{suffix}")
+
+def is_within(path: str, root: str) -> bool:
+    """path 是否位于 root 目录下"""
+    return os.path.abspath(path).startswith(os.path.join(os.path.abspath(root), ''))
+
+def directory_size(path: str) -> int:
+    """递归统计目录占用的字节数"""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += directory_size(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except FileNotFoundError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return total
+
+def load_metrics(metrics_path: str) -> dict:
+    """读取清理统计，不存在时返回空统计"""
+    try:
+        with open(metrics_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {
+            'reclaimed_bytes': {category: 0 for category in SWEEP_CATEGORIES},
+            'reclaimed_files': {category: 0 for category in SWEEP_CATEGORIES},
+            'usage_bytes': {},
+            'sweeps': 0,
+            'last_sweep': None,
+            'last_sweep_seconds': None
+        }
+
+def save_metrics(metrics_path: str, metrics: dict):
+    """原子写入清理统计，Web 进程随时可能读取"""
+    tmp_path = f"{metrics_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metrics, f)
+    os.replace(tmp_path, metrics_path)
+
+def check_quota(device_dirs: list[str], incoming_bytes: int, metrics_path: str):
+    """检查设备配额和全局配额，超出时抛出 QuotaExceeded
+
+    全局用量取自最近一次清理的统计，避免每次上传都遍历整个存储。
+    """
+    if DEVICE_QUOTA_BYTES:
+        used = sum(directory_size(path) for path in device_dirs)
+        if used + incoming_bytes > DEVICE_QUOTA_BYTES:
+            raise QuotaExceeded(
+                f"Device storage quota exceeded ({used / MB:.1f}MB of {DEVICE_QUOTA_BYTES / MB:.0f}MB used)"
+            )
+
+    if GLOBAL_QUOTA_BYTES:
+        used = sum(load_metrics(metrics_path).get('usage_bytes', {}).values())
+        if used + incoming_bytes > GLOBAL_QUOTA_BYTES:
+            raise QuotaExceeded("Global storage quota exceeded")
+
+def iter_files(root: str):
+    """遍历目录树中的文件，返回 (路径, stat)"""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                yield path, os.stat(path)
+            except FileNotFoundError:
+                continue
+
+def remove_empty_dirs(root: str, min_age: float = 0, now: float | None = None):
+    """自底向上删除空的分片目录，保留根目录
+
+    只删除超过 min_age 未修改的目录，刚创建、即将被写入的目录不受影响。
+    """
+    now = now or time.time()
+    removed = set()
+    for dirpath, dirnames, _ in os.walk(root, topdown=False):
+        if dirpath == root:
+            continue
+        try:
+            # 子目录刚被本次清理删除时，上级目录的修改时间也会更新
+            if (now - os.stat(dirpath).st_mtime < min_age
+                    and not any(os.path.join(dirpath, d) in removed for d in dirnames)):
+                continue
+            os.rmdir(dirpath)
+            removed.add(dirpath)
+        except OSError:
+            pass
+
+class Sweeper:
+    """一次清理过程：删除过期和孤立文件，并累计回收量"""
+
+    def __init__(self, now: float | None = None):
+        self.now = now or time.time()
+        self.reclaimed_bytes = {category: 0 for category in SWEEP_CATEGORIES}
+        self.reclaimed_files = {category: 0 for category in SWEEP_CATEGORIES}
+
+    def is_expired(self, stat: os.stat_result, ttl: float) -> bool:
+        return ttl > 0 and self.now - stat.st_mtime > ttl
+
+    def remove(self, category: str, path: str, size: int):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Failed to remove {path}: {e}")
+            return
+        self.reclaimed_bytes[category] += size
+        self.reclaimed_files[category] += 1
+
+    def remove_tree(self, category: str, path: str):
+        size = directory_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        self.reclaimed_bytes[category] += size
+        self.reclaimed_files[category] += 1
+
+    def sweep_expired(self, category: str, root: str, ttl: float):
+        """删除 root 下超过 ttl 未修改的文件"""
+        for path, stat in iter_files(root):
+            if self.is_expired(stat, ttl):
+                self.remove(category, path, stat.st_size)
+
+    def sweep_cache(self, cache_root: str, markdown_root: str) -> set[str]:
+        """删除过期或指向不存在文件的缓存条目，返回仍被引用的 markdown 路径
+
+        过期条目只删除 markdown_root 下的文件；命令行工具的缓存条目指向用户自己的
+        输出目录，只删除条目、保留文件。
+        """
+        referenced = set()
+        for path, stat in iter_files(cache_root):
+            if not path.endswith('.json'):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                markdown_path = entry.get('markdown_path')
+                # 表格切分输出时一个条目对应多个文件
+                markdown_paths = entry.get('parts') or [markdown_path]
+                if not all(isinstance(p, str) for p in markdown_paths):
+                    raise ValueError(f"Malformed cache entry: {path}")
+            except (OSError, ValueError, TypeError, AttributeError):
+                # 无法解析（包括非 UTF-8 内容）的条目按失效处理，不中断整次清理
+                markdown_path = None
+
+            if not markdown_path or not os.path.exists(markdown_path):
+                self.remove('cache', path, stat.st_size)
+            elif self.is_expired(stat, MARKDOWN_TTL):
+                for markdown_path in markdown_paths:
+                    if not is_within(markdown_path, markdown_root):
+                        continue
+                    try:
+                        self.remove('markdown', markdown_path, os.path.getsize(markdown_path))
+                    except FileNotFoundError:
+                        pass
+                self.remove('cache', path, stat.st_size)
+            else:
+                referenced.update(os.path.abspath(p) for p in markdown_paths)
+        return referenced
+
+    def sweep_markdown(self, markdown_root: str, referenced: set[str]) -> list[tuple[float, int, str]]:
+        """删除没有缓存条目的 markdown 和遗留的逐页结果，返回剩余文件"""
+        remaining = []
+        for dirpath, dirnames, filenames in os.walk(markdown_root):
+            # 转换中任务的逐页结果目录
+            for dirname in list(dirnames):
+                if dirname.endswith('.pages'):
+                    dirnames.remove(dirname)
+                    page_dir = os.path.join(dirpath, dirname)
+                    try:
+                        if self.is_expired(os.stat(page_dir), UPLOAD_TTL):
+                            self.remove_tree('orphan_markdown', page_dir)
+                    except FileNotFoundError:
+                        continue
+
+            for filename in filenames:
+                # 只处理转换结果，保留 .gitkeep 等其他文件
+                if not filename.endswith('.md'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if os.path.abspath(path) not in referenced and self.is_expired(stat, ORPHAN_GRACE):
+                    self.remove('orphan_markdown', path, stat.st_size)
+                else:
+                    remaining.append((stat.st_mtime, stat.st_size, path))
+        return remaining
+
+    def enforce_global_quota(self, usage: dict, markdown_files: list[tuple[float, int, str]]):
+        """超出全局配额时从最旧的 markdown 开始删除，对应缓存条目下次清理时移除"""
+        if not GLOBAL_QUOTA_BYTES:
+            return
+        excess = sum(usage.values()) - GLOBAL_QUOTA_BYTES
+        for _, size, path in sorted(markdown_files):
+            if excess <= 0:
+                break
+            self.remove('quota', path, size)
+            usage['markdown'] = usage.get('markdown', 0) - size
+            excess -= size
+
+def sweep(upload_root: str, markdown_root: str, cache_root: str, debug_root: str,
+          batch_root: str, metrics_path: str) -> dict:
+    """批量回收过期上传、孤立 markdown、失效缓存、旧调试页和批量清单，返回本次统计"""
+    started = time.perf_counter()
+    sweeper = Sweeper()
+
+    sweeper.sweep_expired('upload', upload_root, UPLOAD_TTL)
+    referenced = sweeper.sweep_cache(cache_root, markdown_root)
+    markdown_files = sweeper.sweep_markdown(markdown_root, referenced)
+    sweeper.sweep_expired('debug', debug_root, DEBUG_TTL)
+    sweeper.sweep_expired('batch', batch_root, BATCH_TTL)
+
+    roots = {
+        'upload': upload_root,
+        'markdown': markdown_root,
+        'cache': cache_root,
+        'debug': debug_root,
+        'batch': batch_root
+    }
+    for root in roots.values():
+        remove_empty_dirs(root, ORPHAN_GRACE, sweeper.now)
+
+    usage = {area: directory_size(root) for area, root in roots.items()}
+    sweeper.enforce_global_quota(usage, markdown_files)
+
+    metrics = load_metrics(metrics_path)
+    for category in SWEEP_CATEGORIES:
+        metrics['reclaimed_bytes'][category] = metrics['reclaimed_bytes'].get(category, 0) + sweeper.reclaimed_bytes[category]
+        metrics['reclaimed_files'][category] = metrics['reclaimed_files'].get(category, 0) + sweeper.reclaimed_files[category]
+    metrics['usage_bytes'] = usage
+    metrics['sweeps'] += 1
+    metrics['last_sweep'] = sweeper.now
+    metrics['last_sweep_seconds'] = round(time.perf_counter() - started, 3)
+    save_metrics(metrics_path, metrics)
+
+    result = {
+        'reclaimed_bytes': sweeper.reclaimed_bytes,
+        'reclaimed_files': sweeper.reclaimed_files,
+        'usage_bytes': usage,
+        'seconds': metrics['last_sweep_seconds']
+    }
+    logger.info(f"Storage sweep finished: {result}")
+    return result
+
+def render_prometheus_metrics(metrics: dict) -> str:
+    """将清理统计转换为 Prometheus 文本格式"""
+    lines = [
+        '# HELP doctomd_storage_reclaimed_bytes_total Bytes reclaimed by the storage sweeper.',
+        '# TYPE doctomd_storage_reclaimed_bytes_total counter',
+    ]
+    for category, value in metrics['reclaimed_bytes'].items():
+        lines.append(f'doctomd_storage_reclaimed_bytes_total{{category="{category}"}} {value}')
+    lines += [
+        '# HELP doctomd_storage_reclaimed_files_total Files reclaimed by the storage sweeper.',
+        '# TYPE doctomd_storage_reclaimed_files_total counter',
+    ]
+    for category, value in metrics['reclaimed_files'].items():
+        lines.append(f'doctomd_storage_reclaimed_files_total{{category="{category}"}} {value}')
+    lines += [
+        '# HELP doctomd_storage_usage_bytes Bytes used per storage area at the last sweep.',
+        '# TYPE doctomd_storage_usage_bytes gauge',
+    ]
+    for area, value in metrics['usage_bytes'].items():
+        lines.append(f'doctomd_storage_usage_bytes{{area="{area}"}} {value}')
+    lines += [
+        '# HELP doctomd_storage_sweeps_total Completed storage sweeps.',
+        '# TYPE doctomd_storage_sweeps_total counter',
+        f"doctomd_storage_sweeps_total {metrics['sweeps']}",
+        '# HELP doctomd_storage_last_sweep_timestamp_seconds Time of the last storage sweep.',
+        '# TYPE doctomd_storage_last_sweep_timestamp_seconds gauge',
+        f"doctomd_storage_last_sweep_timestamp_seconds {metrics['last_sweep'] or 0}",
+    ]
+    return '\n'.join(lines) + '\n'
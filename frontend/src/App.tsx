@@ -8,10 +8,13 @@ import type { FileWithStatus } from "./types/file";
 function App() {
   const {
     files,
+    batches,
     addFiles,
     convertFiles,
     retryFile,
     clearHistory,
+    cancelBatch,
+    downloadBatch,
     updateFileStatus,
   } = useFileConversion();
 
@@ -90,8 +93,11 @@ function App() {
           <FileUpload onFilesSelected={addFiles} />
           <ConversionProgress
             files={files}
+            batches={batches}
             onRetry={retryFile}
             onClearHistory={handleClearHistory} // 使用包装的处理函数
+            onCancelBatch={cancelBatch}
+            onDownloadBatch={downloadBatch}
           />
 
           {files.some((f) => f.status === "pending") && (
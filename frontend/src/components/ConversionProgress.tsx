@@ -1,19 +1,29 @@
 import React, { useState, useEffect, useRef } from "react";
 import { FileType, Download, Eye, X, Clock, Trash2 } from "lucide-react"; // 添加 Trash2 图标
-import type { FileWithStatus } from "../types/file";
-import { downloadMarkdown, previewMarkdown } from "../services/api";
+import type { BatchConversionStatus, FileWithStatus } from "../types/file";
+import {
+  cancelConversion,
+  downloadMarkdown,
+  previewMarkdown,
+} from "../services/api";
 import { formatDate } from "../utils/date"; // 新增工具函数
 
 interface ConversionProgressProps {
   files: FileWithStatus[];
+  batches: BatchConversionStatus[];
   onRetry: (id: string) => void;
   onClearHistory: () => void; // 新增属性
+  onCancelBatch: (batchId: string) => void;
+  onDownloadBatch: (batchId: string) => void;
 }
 
 export function ConversionProgress({
   files,
+  batches,
   onRetry,
   onClearHistory,
+  onCancelBatch,
+  onDownloadBatch,
 }: ConversionProgressProps) {
   const [previewContent, setPreviewContent] = useState<string>("");
   const [showPreview, setShowPreview] = useState(false);
@@ -76,6 +86,16 @@ export function ConversionProgress({
     }
   };
 
+  const handleCancel = async (file: FileWithStatus) => {
+    if (file.taskId) {
+      try {
+        await cancelConversion(file.taskId);
+      } catch (error) {
+        console.error("Cancel failed:", error);
+      }
+    }
+  };
+
   const handleClearHistory = async () => {
     if (isClearing) return;
 
@@ -130,6 +150,49 @@ export function ConversionProgress({
             </div>
           )}
         </div>
+        {batches.map((batch) => (
+          <div
+            key={batch.id}
+            className="p-3 mb-4 border border-gray-200 rounded-md"
+          >
+            <div className="flex items-center justify-between">
+              <p className="text-sm text-gray-700">
+                批量转换: {batch.completed}/{batch.total} 完成
+                {batch.failed > 0 && `，${batch.failed} 失败`}
+                {batch.cancelled > 0 && `，${batch.cancelled} 已取消`}
+              </p>
+              <div className="flex items-center space-x-2">
+                {batch.downloadUrl && (
+                  <button
+                    onClick={() => onDownloadBatch(batch.id)}
+                    className="flex items-center gap-1 text-sm text-green-600 hover:text-green-700"
+                    title="Download all as ZIP"
+                  >
+                    <Download className="w-4 h-4" />
+                    <span>ZIP</span>
+                  </button>
+                )}
+                {batch.state === "PROGRESS" && (
+                  <button
+                    onClick={() => onCancelBatch(batch.id)}
+                    className="p-1 text-red-600 hover:text-red-700"
+                    title="Cancel batch"
+                  >
+                    <X className="w-4 h-4" />
+                  </button>
+                )}
+              </div>
+            </div>
+            {batch.state === "PROGRESS" && (
+              <div className="mt-2 w-full bg-gray-200 rounded-full h-1.5">
+                <div
+                  className="bg-blue-600 h-1.5 rounded-full transition-all duration-300"
+                  style={{ width: `${batch.progress}%` }}
+                />
+              </div>
+            )}
+          </div>
+        ))}
         <ul className="divide-y divide-gray-200">
           {files.map((file) => (
             <li
@@ -178,6 +241,24 @@ export function ConversionProgress({
                       Retry
                     </button>
                   )}
+                  {file.status === "converting" && file.previewUrl && (
+                    <button
+                      onClick={() => handlePreview(file)}
+                      className="p-1 text-blue-600 hover:text-blue-700"
+                      title="Preview completed pages"
+                    >
+                      <Eye className="w-5 h-5" />
+                    </button>
+                  )}
+                  {file.status === "converting" && file.taskId && (
+                    <button
+                      onClick={() => handleCancel(file)}
+                      className="p-1 text-red-600 hover:text-red-700"
+                      title="Cancel"
+                    >
+                      <X className="w-5 h-5" />
+                    </button>
+                  )}
                   {file.status === "converting" && (
                     <div className="w-5 h-5 border-2 border-blue-600 rounded-full border-t-transparent animate-spin" />
                   )}
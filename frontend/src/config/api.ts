@@ -4,4 +4,5 @@ export const API_BASE_URL = '/api';
 export const API_ENDPOINTS = {
   convert: `${API_BASE_URL}/convert`,
   status: `${API_BASE_URL}/status`,
+  batch: `${API_BASE_URL}/batch`,
 } as const;
\ No newline at end of file
@@ -1,14 +1,56 @@
 import { useState, useCallback, useEffect } from "react";
 import { v4 as uuidv4 } from "uuid";
-import { convertFile, clearConversionHistory } from "../services/api";
+import {
+  convertFile,
+  convertBatch,
+  checkBatchStatus,
+  cancelBatch,
+  downloadBatch,
+  clearConversionHistory,
+} from "../services/api";
 import { useStatusCheck } from "./useStatusCheck";
 import { useDeviceId } from "./useDeviceId";
-import type { FileWithStatus } from "../types/file";
+import type { BatchConversionStatus, FileWithStatus } from "../types/file";
 
 const STORAGE_KEY = "file_conversion_history";
+const BATCH_STORAGE_KEY = "file_conversion_batches";
+// 单个请求的上传上限，低于服务端 MAX_CONTENT_LENGTH 和 nginx client_max_body_size（1GB）
+const MAX_BATCH_BYTES = 512 * 1024 * 1024;
+
+// 按总大小把文件分成多个批次，超过上限的大文件单独一批
+function splitIntoBatches(files: FileWithStatus[]): FileWithStatus[][] {
+  const batches: FileWithStatus[][] = [];
+  let current: FileWithStatus[] = [];
+  let currentBytes = 0;
+  for (const file of files) {
+    if (current.length > 0 && currentBytes + file.file.size > MAX_BATCH_BYTES) {
+      batches.push(current);
+      current = [];
+      currentBytes = 0;
+    }
+    current.push(file);
+    currentBytes += file.file.size;
+  }
+  if (current.length > 0) {
+    batches.push(current);
+  }
+  return batches;
+}
+
+function loadBatchIds(): string[] {
+  try {
+    return JSON.parse(localStorage.getItem(BATCH_STORAGE_KEY) || "[]");
+  } catch {
+    return [];
+  }
+}
 
 export function useFileConversion() {
   const [files, setFiles] = useState<FileWithStatus[]>([]);
+  // 各批次的整体状态，按批次ID索引
+  const [batches, setBatches] = useState<Record<string, BatchConversionStatus>>(
+    {}
+  );
   const deviceId = useDeviceId();
   // 只保存必要的状态信息到localStorage
   const saveToLocalStorage = useCallback((updatedFiles: FileWithStatus[]) => {
@@ -43,8 +85,25 @@ export function useFileConversion() {
     },
     [saveToLocalStorage]
   );
-  const { startStatusCheck, checkBatchStatus } =
-    useStatusCheck(updateFileStatus);
+  const { startStatusCheck } = useStatusCheck(updateFileStatus);
+
+  // 轮询批量任务的整体进度，批次结束后停止
+  const startBatchStatusCheck = useCallback((batchId: string) => {
+    const intervalId = window.setInterval(async () => {
+      try {
+        const status = await checkBatchStatus(batchId);
+        setBatches((prev) => ({ ...prev, [batchId]: status }));
+        if (status.state !== "PROGRESS") {
+          clearInterval(intervalId);
+        }
+      } catch (error) {
+        clearInterval(intervalId);
+        console.error("Batch status check failed:", error);
+      }
+    }, 1000);
+
+    return intervalId;
+  }, []);
 
   // 修改从localStorage恢复状态的逻辑
   useEffect(() => {
@@ -83,7 +142,9 @@ export function useFileConversion() {
         console.error("Failed to restore conversion history:", error);
       }
     }
-  }, [deviceId, startStatusCheck]);
+
+    loadBatchIds().forEach((batchId) => startBatchStatusCheck(batchId));
+  }, [deviceId, startStatusCheck, startBatchStatusCheck]);
 
   // 确保文件状态改变时保存到localStorage
   useEffect(() => {
@@ -105,25 +166,83 @@ export function useFileConversion() {
 
   const convertFiles = useCallback(async () => {
     const pendingFiles = files.filter((f) => f.status === "pending");
+    if (pendingFiles.length === 0) return;
 
-    for (const file of pendingFiles) {
+    pendingFiles.forEach((file) =>
       updateFileStatus(file.id, {
         status: "converting",
         description: "开始转换...",
-      });
+      })
+    );
 
-      try {
-        const result = await convertFile(file.file, deviceId);
-        updateFileStatus(file.id, { taskId: result.id });
-        startStatusCheck(file.id, result.id);
-      } catch (error) {
+    const markFailed = (batchFiles: FileWithStatus[], error: unknown) =>
+      batchFiles.forEach((file) =>
         updateFileStatus(file.id, {
           status: "error",
           error: error instanceof Error ? error.message : "转换失败",
+        })
+      );
+
+    // 按大小分批提交，一个批次失败不影响其他批次
+    for (const batchFiles of splitIntoBatches(pendingFiles)) {
+      if (batchFiles.length === 1) {
+        // 单个文件（包括超过批次上限的大文件）走单文件接口
+        const [file] = batchFiles;
+        try {
+          const result = await convertFile(file.file, deviceId);
+          updateFileStatus(file.id, { taskId: result.id });
+          startStatusCheck(file.id, result.id);
+        } catch (error) {
+          markFailed(batchFiles, error);
+        }
+        continue;
+      }
+
+      // 服务端按上传顺序返回每个文件的任务ID
+      try {
+        const result = await convertBatch(
+          batchFiles.map((f) => f.file),
+          deviceId
+        );
+        localStorage.setItem(
+          BATCH_STORAGE_KEY,
+          JSON.stringify([...loadBatchIds(), result.id])
+        );
+        startBatchStatusCheck(result.id);
+
+        const taskIds = new Map<string, string[]>();
+        result.items.forEach((item) => {
+          taskIds.set(item.filename, [
+            ...(taskIds.get(item.filename) || []),
+            item.id,
+          ]);
         });
+
+        for (const file of batchFiles) {
+          const taskId = taskIds.get(file.file.name)?.shift();
+          if (!taskId) {
+            updateFileStatus(file.id, {
+              status: "error",
+              error: "Unsupported file type",
+            });
+            continue;
+          }
+          updateFileStatus(file.id, { taskId });
+          startStatusCheck(file.id, taskId);
+        }
+      } catch (error) {
+        markFailed(batchFiles, error);
       }
     }
-  }, [files, deviceId, startStatusCheck, updateFileStatus]);
+  }, [files, deviceId, startStatusCheck, startBatchStatusCheck, updateFileStatus]);
+
+  const cancelBatchConversion = useCallback(async (batchId: string) => {
+    try {
+      await cancelBatch(batchId);
+    } catch (error) {
+      console.error("Cancel batch failed:", error);
+    }
+  }, []);
 
   const retryFile = useCallback(
     async (fileId: string) => {
@@ -163,15 +282,20 @@ export function useFileConversion() {
     }
 
     setFiles([]);
+    setBatches({});
     localStorage.removeItem(STORAGE_KEY);
+    localStorage.removeItem(BATCH_STORAGE_KEY);
   }, [files, deviceId]);
 
   return {
     files,
+    batches: Object.values(batches),
     addFiles,
     convertFiles,
     retryFile,
     clearHistory,
+    cancelBatch: cancelBatchConversion,
+    downloadBatch,
     updateFileStatus,
   };
 }
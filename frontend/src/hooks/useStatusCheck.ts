@@ -38,6 +38,15 @@ export function useStatusCheck(
               clearInterval(intervalId);
               break;
 
+            case "REVOKED":
+              updateFileStatus(fileId, {
+                status: "error",
+                error: status.error || "Conversion cancelled",
+                description: status.description,
+              });
+              clearInterval(intervalId);
+              break;
+
             case "PENDING":
             case "PROGRESS":
               // 只有当前状态是 converting 或 pending 时才更新进度
@@ -45,6 +54,8 @@ export function useStatusCheck(
                 status: "converting",
                 progress: status.progress,
                 description: status.description,
+                // 已有完成的页面时可以提前预览
+                previewUrl: status.previewUrl,
               });
               break;
           }
@@ -1,13 +1,23 @@
 import { API_ENDPOINTS } from "../config/api";
-import type { ConversionResult, ConversionStatus } from "../types/file";
+import type {
+  BatchConversionResult,
+  BatchConversionStatus,
+  ConversionResult,
+  ConversionStatus,
+} from "../types/file";
 
 export async function convertFile(
   file: File,
-  deviceId: string
+  deviceId: string,
+  pages?: string
 ): Promise<ConversionResult> {
   const formData = new FormData();
   formData.append("file", file);
   formData.append("deviceId", deviceId);
+  // 页码范围，如 "1-10,15"，仅对 PDF 有效
+  if (pages) {
+    formData.append("pages", pages);
+  }
 
   const response = await fetch(API_ENDPOINTS.convert, {
     method: "POST",
@@ -26,6 +36,53 @@ export async function convertFile(
   };
 }
 
+export async function convertBatch(
+  files: File[],
+  deviceId: string
+): Promise<BatchConversionResult> {
+  const formData = new FormData();
+  files.forEach((file) => formData.append("files", file));
+  formData.append("deviceId", deviceId);
+
+  const response = await fetch(`${API_ENDPOINTS.convert}/batch`, {
+    method: "POST",
+    body: formData,
+  });
+
+  if (!response.ok) {
+    const error = await response.json();
+    throw new Error(error.message || error.error || "Batch conversion failed");
+  }
+
+  return response.json();
+}
+
+export async function checkBatchStatus(
+  batchId: string
+): Promise<BatchConversionStatus> {
+  const response = await fetch(`${API_ENDPOINTS.batch}/${batchId}/status`);
+
+  if (!response.ok) {
+    throw new Error("Failed to fetch batch status");
+  }
+
+  const result = await response.json();
+  return {
+    ...result,
+    downloadUrl: result.download_url,
+  };
+}
+
+export async function downloadBatch(batchId: string) {
+  // 直接交给浏览器下载，避免把整个 ZIP 读入内存
+  const link = document.createElement("a");
+  link.href = `${API_ENDPOINTS.batch}/${batchId}/download`;
+  link.download = `${batchId}.zip`;
+  document.body.appendChild(link);
+  link.click();
+  document.body.removeChild(link);
+}
+
 export async function checkConversionStatus(
   taskId: string
 ): Promise<ConversionStatus> {
@@ -43,6 +100,8 @@ export async function checkConversionStatus(
     previewUrl: result.preview_url,
     downloadUrl: result.download_url,
     error: result.error,
+    completedPages: result.completed_pages,
+    totalPages: result.total_pages,
   };
 }
 
@@ -65,9 +124,13 @@ export async function getBatchConversionStatus(
 }
 
 export async function previewMarkdown(
-  taskId: string
-): Promise<{ content: string; filename: string }> {
-  const response = await fetch(`${API_ENDPOINTS.convert}/${taskId}/preview`);
+  taskId: string,
+  pages?: string
+): Promise<{ content: string; filename: string; partial?: boolean }> {
+  const query = pages ? `?pages=${encodeURIComponent(pages)}` : "";
+  const response = await fetch(
+    `${API_ENDPOINTS.convert}/${taskId}/preview${query}`
+  );
 
   if (!response.ok) {
     throw new Error("Failed to preview file");
@@ -94,6 +157,30 @@ export async function downloadMarkdown(taskId: string, filename: string) {
   URL.revokeObjectURL(downloadUrl);
 }
 
+export async function cancelConversion(taskId: string) {
+  const response = await fetch(`${API_ENDPOINTS.convert}/${taskId}/cancel`, {
+    method: "POST",
+  });
+
+  if (!response.ok) {
+    throw new Error("Failed to cancel conversion");
+  }
+
+  return response.json();
+}
+
+export async function cancelBatch(batchId: string) {
+  const response = await fetch(`${API_ENDPOINTS.batch}/${batchId}/cancel`, {
+    method: "POST",
+  });
+
+  if (!response.ok) {
+    throw new Error("Failed to cancel batch");
+  }
+
+  return response.json();
+}
+
 export async function clearConversionHistory(
   taskIds: string[],
   deviceId: string
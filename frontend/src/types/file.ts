@@ -37,4 +37,26 @@ export interface ConversionStatus {
   previewUrl?: string;
   downloadUrl?: string;
   error?: string;
+  completedPages?: number;
+  totalPages?: number;
+}
+
+export interface BatchConversionResult {
+  id: string;
+  message: string;
+  items: { filename: string; id: string }[];
+  rejected: string[];
+  missing: string[];
+}
+
+export interface BatchConversionStatus {
+  id: string;
+  state: string;
+  progress: number;
+  total: number;
+  completed: number;
+  failed: number;
+  cancelled: number;
+  items: { id: string; filename: string; state: string; progress: number }[];
+  downloadUrl?: string;
 }